@@ -0,0 +1,303 @@
+import argparse
+import json
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from concurrency import AIMDLimiter
+from context import get_reference_answer
+from llm import generate
+from row_ids import get_row_id
+from main import (
+    DATA_FILE,
+    EVALUATION_RUBRICS,
+    create_absolute_grading_prompt,
+    get_annotated_data,
+    get_criteria_key,
+    get_human_annotation,
+    load_data,
+    parse_judgment,
+)
+
+
+def stratified_order(annotated_data, criteria_key, rng):
+    """
+    Orders row indices so every prefix keeps the human label ratio of the criterion.
+
+    Rows of each label are shuffled and then interleaved by their relative
+    position within their label.
+    """
+    strata = {True: [], False: []}
+    for index, item in enumerate(annotated_data):
+        strata[get_human_annotation(item)[criteria_key]].append(index)
+
+    positions = []
+    for rows in strata.values():
+        rng.shuffle(rows)
+        for rank, index in enumerate(rows):
+            positions.append(((rank + 0.5) / len(rows), rng.random(), index))
+    return [index for _, _, index in sorted(positions)]
+
+
+def f1_from_counts(tp, fp, fn):
+    precision = tp / (tp + fp) if (tp + fp) > 0 else 0
+    recall = tp / (tp + fn) if (tp + fn) > 0 else 0
+    f1 = (
+        2 * (precision * recall) / (precision + recall)
+        if (precision + recall) > 0
+        else 0
+    )
+    return precision, recall, f1
+
+
+def credible_intervals(counts, rng, confidence=0.95, samples=2000):
+    """
+    Estimates intervals for precision, recall and F1 from a confusion matrix.
+
+    Cell probabilities are drawn from a Dirichlet posterior (Jeffreys prior of
+    0.5 per cell) and the metrics are computed for every draw.
+
+    Returns:
+        dict: (low, high) for "precision", "recall" and "f1".
+    """
+    draws = {"precision": [], "recall": [], "f1": []}
+    for _ in range(samples):
+        # True negatives do not enter precision, recall or F1
+        tp, fp, fn = (
+            rng.gammavariate(counts[cell] + 0.5, 1) for cell in ("tp", "fp", "fn")
+        )
+        precision, recall, f1 = f1_from_counts(tp, fp, fn)
+        draws["precision"].append(precision)
+        draws["recall"].append(recall)
+        draws["f1"].append(f1)
+
+    tail = (1 - confidence) / 2
+    intervals = {}
+    for metric, values in draws.items():
+        values.sort()
+        intervals[metric] = (
+            values[int(tail * (samples - 1))],
+            values[int((1 - tail) * (samples - 1))],
+        )
+    return intervals
+
+
+def reference_f1(file_path, criteria_key):
+    """Computes a reference judge's F1 on a criterion over its whole result file."""
+    with open(file_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    counts = {"tp": 0, "fp": 0, "fn": 0}
+    for results in data.values():
+        values = results.get(criteria_key, {})
+        prediction = values.get("acceptable", False)
+        human_label = values.get("human_annotation", False)
+        if prediction and human_label:
+            counts["tp"] += 1
+        elif prediction and not human_label:
+            counts["fp"] += 1
+        elif not prediction and human_label:
+            counts["fn"] += 1
+    return f1_from_counts(counts["tp"], counts["fp"], counts["fn"])[2]
+
+
+def active_evaluate(
+    model_name,
+    annotated_data,
+    reference_file=None,
+    batch_size=8,
+    min_rows=20,
+    max_width=0.1,
+    confidence=0.95,
+    max_concurrency=16,
+    seed=0,
+):
+    """
+    Scores a candidate judge on a stratified sample until the estimate is settled.
+
+    Each criterion is sampled on its own, batch_size rows per round. A
+    criterion stops after min_rows rows once its F1 interval is narrower than
+    max_width, or once the reference judge's F1 lies outside the interval, so
+    the ranking against it is known.
+
+    Returns:
+        tuple: (report per criterion, score_mapping of the rows judged)
+    """
+    rng = random.Random(seed)
+    limiter = AIMDLimiter(maximum=max_concurrency)
+
+    states = {}
+    for rubric in EVALUATION_RUBRICS:
+        criteria_key = get_criteria_key(rubric)
+        states[criteria_key] = {
+            "rubric": rubric,
+            "order": stratified_order(annotated_data, criteria_key, rng),
+            "counts": {"tp": 0, "fp": 0, "fn": 0, "tn": 0},
+            "judged": 0,
+            "reference_f1": (
+                reference_f1(reference_file, criteria_key) if reference_file else None
+            ),
+            "stopped": None,
+        }
+
+    score_mapping = {}
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        while True:
+            active = [key for key, state in states.items() if state["stopped"] is None]
+            if not active:
+                break
+
+            jobs = []
+            for criteria_key in active:
+                state = states[criteria_key]
+                start = state["judged"]
+                for index in state["order"][start : start + batch_size]:
+                    item = annotated_data[index]
+                    absolute_prompt = create_absolute_grading_prompt(
+                        item.get("question", ""),
+                        item.get("model_answer", ""),
+                        get_reference_answer(item, state["rubric"]),
+                        state["rubric"],
+                    )
+                    future = executor.submit(
+                        generate,
+                        model_name=model_name,
+                        prompt_text=absolute_prompt,
+                        limiter=limiter,
+                    )
+                    jobs.append((criteria_key, item, future))
+
+            for criteria_key, item, future in jobs:
+                state = states[criteria_key]
+                human_label = get_human_annotation(item)[criteria_key]
+                judgment = parse_judgment(future.result(), human_label)
+                row_id = get_row_id(item)
+                if row_id not in score_mapping:
+                    score_mapping[row_id] = {"question": item.get("question", "")}
+                score_mapping[row_id][criteria_key] = judgment
+
+                prediction = judgment["acceptable"]
+                cell = ("t" if prediction == human_label else "f") + (
+                    "p" if prediction else "n"
+                )
+                state["counts"][cell] += 1
+                state["judged"] += 1
+
+            for criteria_key in active:
+                state = states[criteria_key]
+                state["intervals"] = credible_intervals(
+                    state["counts"], rng, confidence
+                )
+                low, high = state["intervals"]["f1"]
+                reference = state["reference_f1"]
+
+                if state["judged"] >= len(state["order"]):
+                    state["stopped"] = "all rows judged"
+                elif state["judged"] < min_rows:
+                    continue
+                elif high - low <= max_width:
+                    state["stopped"] = "interval narrow enough"
+                elif reference is not None and not low <= reference <= high:
+                    state["stopped"] = "ranking against reference settled"
+
+    report = {}
+    for criteria_key, state in states.items():
+        counts = state["counts"]
+        precision, recall, f1 = f1_from_counts(counts["tp"], counts["fp"], counts["fn"])
+        report[criteria_key] = {
+            "rows_judged": state["judged"],
+            "calls_saved": len(state["order"]) - state["judged"],
+            "precision": precision,
+            "recall": recall,
+            "f1": f1,
+            "intervals": state["intervals"],
+            "reference_f1": state["reference_f1"],
+            "stopped": state["stopped"],
+        }
+    return report, score_mapping
+
+
+def print_report(model_name, report, confidence):
+    print(f"Active evaluation of {model_name} ({confidence:.0%} intervals):")
+    for criteria_key, result in report.items():
+        intervals = result["intervals"]
+        print(f"\nCriterion: {criteria_key}")
+        print(f"  - Rows judged: {result['rows_judged']} ({result['stopped']})")
+        for metric in ["precision", "recall", "f1"]:
+            low, high = intervals[metric]
+            print(
+                f"  - {metric.capitalize()}: {result[metric]:.2f} "
+                f"[{low:.2f}, {high:.2f}]"
+            )
+        if result["reference_f1"] is not None:
+            verdict = "within interval"
+            if result["reference_f1"] > intervals["f1"][1]:
+                verdict = "reference is better"
+            elif result["reference_f1"] < intervals["f1"][0]:
+                verdict = "candidate is better"
+            print(f"  - Reference F1: {result['reference_f1']:.2f} ({verdict})")
+
+    saved = sum(result["calls_saved"] for result in report.values())
+    total = saved + sum(result["rows_judged"] for result in report.values())
+    print(f"\nCalls saved: {saved} of {total} ({saved / total:.0%})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Estimate a candidate judge's F1 from a stratified sample."
+    )
+    parser.add_argument("model", help="The candidate judge model.")
+    parser.add_argument(
+        "--reference",
+        help="A judge result file in spanish_rosie_evals to compare against.",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=8, help="Rows per criterion per round."
+    )
+    parser.add_argument(
+        "--min-rows",
+        type=int,
+        default=20,
+        help="Rows per criterion to judge before stopping early.",
+    )
+    parser.add_argument(
+        "--max-width",
+        type=float,
+        default=0.1,
+        help="Stop a criterion once its F1 interval is this narrow.",
+    )
+    parser.add_argument(
+        "--confidence", type=float, default=0.95, help="Interval coverage."
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=16,
+        help="Upper bound of requests in flight.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Sampling seed.")
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Save the judged rows to this JSON file in the usual result format.",
+    )
+
+    args = parser.parse_args()
+
+    annotated_data = get_annotated_data(load_data(DATA_FILE))
+    report, score_mapping = active_evaluate(
+        args.model,
+        annotated_data,
+        reference_file=args.reference,
+        batch_size=args.batch_size,
+        min_rows=args.min_rows,
+        max_width=args.max_width,
+        confidence=args.confidence,
+        max_concurrency=args.max_concurrency,
+        seed=args.seed,
+    )
+    print_report(args.model, report, args.confidence)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(score_mapping, f, ensure_ascii=False, indent=4)
+        print(f"Judged rows saved to {args.output}")
@@ -0,0 +1,269 @@
+import argparse
+import glob
+import json
+import os
+from itertools import combinations
+
+import pandas as pd
+from plotnine import (
+    aes,
+    element_text,
+    facet_wrap,
+    geom_text,
+    geom_tile,
+    ggplot,
+    ggsave,
+    labs,
+    scale_fill_gradient2,
+    theme,
+)
+
+from figures import shorten_model_name
+
+ASPECTS = ["relevance", "attributes", "facts", "preference"]
+
+
+def pack_verdicts(data, row_ids, aspect, field="acceptable"):
+    """
+    Packs one boolean field of a result file into bitsets over a row ID list.
+
+    Bit i of the verdict bitset is set when row_ids[i] has the field set to
+    True, and bit i of the mask is set when the field is present at all.
+
+    Returns:
+        tuple: (verdicts, mask) as Python ints.
+    """
+    verdicts = 0
+    mask = 0
+    for index, row_id in enumerate(row_ids):
+        value = data.get(row_id, {}).get(aspect, {}).get(field)
+        if isinstance(value, bool):
+            mask |= 1 << index
+            if value:
+                verdicts |= 1 << index
+    return verdicts, mask
+
+
+def cohen_kappa(a, b, mask):
+    """Computes the agreement count and Cohen's kappa of two verdict bitsets."""
+    n = mask.bit_count()
+    if n == 0:
+        return 0, None
+
+    agree = n - ((a ^ b) & mask).bit_count()
+    p_a = (a & mask).bit_count() / n
+    p_b = (b & mask).bit_count() / n
+    observed = agree / n
+    expected = p_a * p_b + (1 - p_a) * (1 - p_b)
+
+    if expected == 1:
+        return agree, 1.0
+    return agree, (observed - expected) / (1 - expected)
+
+
+def fleiss_kappa(verdicts, mask):
+    """
+    Computes Fleiss' kappa of a panel of binary verdict bitsets.
+
+    The per-question sum of squared "yes" counts is expanded into pairwise
+    intersections, sum_i yes_i^2 = sum_j |a_j| + 2 sum_{j<k} |a_j & a_k|,
+    so the whole panel is scored with popcounts only.
+    """
+    n = mask.bit_count()
+    raters = len(verdicts)
+    if n == 0 or raters < 2:
+        return None
+
+    yes = [a & mask for a in verdicts]
+    no = [~a & mask for a in verdicts]
+
+    def sum_of_squares(bitsets):
+        total = sum(bitset.bit_count() for bitset in bitsets)
+        for first, second in combinations(bitsets, 2):
+            total += 2 * (first & second).bit_count()
+        return total
+
+    agreement = (sum_of_squares(yes) + sum_of_squares(no) - n * raters) / (
+        n * raters * (raters - 1)
+    )
+    p_yes = sum(bitset.bit_count() for bitset in yes) / (n * raters)
+    expected = p_yes**2 + (1 - p_yes) ** 2
+
+    if expected == 1:
+        return 1.0
+    return (agreement - expected) / (1 - expected)
+
+
+def analyze_agreement(files):
+    """
+    Measures how often every pair of judges agrees, per criterion.
+
+    Args:
+        files (list): Paths to single-judge result files (JSON).
+
+    Returns:
+        tuple: (pairs, panel) where pairs has one row per judge pair and
+        criterion, and panel maps each criterion to its Fleiss' kappa.
+    """
+    data = {}
+    for file_path in files:
+        with open(file_path, "r", encoding="utf-8") as f:
+            data[shorten_model_name(os.path.basename(file_path))] = json.load(f)
+
+    row_ids = sorted(set().union(*(results.keys() for results in data.values())))
+    judges = list(data)
+
+    pairs = []
+    panel = {}
+    for aspect in ASPECTS:
+        packed = {
+            judge: pack_verdicts(data[judge], row_ids, aspect) for judge in judges
+        }
+
+        # Human labels are the same in every file; take the first one present
+        human = 0
+        human_mask = 0
+        for judge in judges:
+            labels, labels_mask = pack_verdicts(
+                data[judge], row_ids, aspect, "human_annotation"
+            )
+            new = labels_mask & ~human_mask
+            human |= labels & new
+            human_mask |= new
+
+        common = human_mask
+        for _, mask in packed.values():
+            common &= mask
+        panel[aspect] = fleiss_kappa([packed[j][0] for j in judges], common)
+
+        for judge_one, judge_two in combinations(judges, 2):
+            a, mask_a = packed[judge_one]
+            b, mask_b = packed[judge_two]
+            mask = mask_a & mask_b
+            n = mask.bit_count()
+            agree, kappa = cohen_kappa(a, b, mask)
+
+            # Where both judges agree, the DAFE verdict is their shared verdict
+            agreed = ~(a ^ b) & mask & human_mask
+            agreed_correct = (agreed & ~(a ^ human)).bit_count()
+
+            pairs.append(
+                {
+                    "judge_one": judge_one,
+                    "judge_two": judge_two,
+                    "criterion": aspect,
+                    "rows": n,
+                    "agreements": agree,
+                    "cohen_kappa": kappa,
+                    "arbitration_rate": (n - agree) / n if n else None,
+                    "agreed_accuracy": (
+                        agreed_correct / agreed.bit_count()
+                        if agreed.bit_count()
+                        else None
+                    ),
+                }
+            )
+
+    return pairs, panel
+
+
+def generate_kappa_heatmap(pairs):
+    """Generate the faceted Cohen's kappa heatmap of every judge pair."""
+    rows = []
+    for pair in pairs:
+        for x, y in [
+            (pair["judge_one"], pair["judge_two"]),
+            (pair["judge_two"], pair["judge_one"]),
+        ]:
+            rows.append(
+                {
+                    "judge_x": x,
+                    "judge_y": y,
+                    "criterion": pair["criterion"].capitalize(),
+                    "cohen_kappa": pair["cohen_kappa"],
+                }
+            )
+    df = pd.DataFrame(rows)
+
+    chart = (
+        ggplot(df, aes(x="judge_x", y="judge_y", fill="cohen_kappa"))
+        + geom_tile()
+        + geom_text(aes(label="cohen_kappa"), format_string="{:.2f}", size=7)
+        + scale_fill_gradient2(low="#b2182b", mid="#f7f7f7", high="#2166ac")
+        + facet_wrap("~criterion", ncol=2)
+        + theme(
+            axis_text_x=element_text(angle=60, hjust=1, size=8), figure_size=(14, 12)
+        )
+        + labs(
+            title="Cohen's Kappa Between Judges by Criterion",
+            x="Judge",
+            y="Judge",
+            fill="Kappa",
+        )
+    )
+    output_path = "figures/agreement_kappa.png"
+    ggsave(chart, filename=output_path, dpi=300)
+    print(f"Agreement heatmap saved to {output_path}")
+
+
+def print_agreement(pairs, panel):
+    print("Panel agreement (Fleiss' kappa):")
+    for aspect, kappa in panel.items():
+        print(f"  - {aspect}: {'n/a' if kappa is None else f'{kappa:.3f}'}")
+
+    print("\nCandidate DAFE pairs (lowest average arbitration rate first):")
+    by_pair = {}
+    for pair in pairs:
+        by_pair.setdefault((pair["judge_one"], pair["judge_two"]), []).append(pair)
+
+    def average(rows, key):
+        values = [row[key] for row in rows if row[key] is not None]
+        return sum(values) / len(values) if values else 0.0
+
+    for (judge_one, judge_two), rows in sorted(
+        by_pair.items(), key=lambda item: average(item[1], "arbitration_rate")
+    ):
+        print(f"\n{judge_one} + {judge_two}")
+        print(
+            f"  - Arbitration calls: {average(rows, 'arbitration_rate'):.2%} "
+            f"(accuracy when agreeing: {average(rows, 'agreed_accuracy'):.2%})"
+        )
+        for row in rows:
+            kappa = "n/a" if row["cohen_kappa"] is None else f"{row['cohen_kappa']:.3f}"
+            print(
+                f"    {row['criterion']}: kappa {kappa}, "
+                f"{row['agreements']}/{row['rows']} agree"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure inter-judge agreement and rank candidate DAFE pairs."
+    )
+    parser.add_argument(
+        "files",
+        nargs="*",
+        help="Single-judge result files. Defaults to every "
+        "*_evaluation_results.json in spanish_rosie_evals.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Also save the pairwise agreement table to this JSON file.",
+    )
+
+    args = parser.parse_args()
+
+    files = args.files or sorted(
+        glob.glob("spanish_rosie_evals/*_evaluation_results.json")
+    )
+    pairs, panel = analyze_agreement(files)
+    print_agreement(pairs, panel)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"pairs": pairs, "fleiss_kappa": panel}, f, indent=4)
+        print(f"\nAgreement table saved to {args.output}")
+
+    os.makedirs("figures", exist_ok=True)
+    generate_kappa_heatmap(pairs)
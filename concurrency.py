@@ -0,0 +1,142 @@
+import threading
+import time
+from collections import deque
+
+
+class AIMDLimiter:
+    """
+    Limits the requests in flight to one model with AIMD.
+
+    AIMD is additive increase, multiplicative decrease. Every healthy response
+    adds increase / limit to the limit, so the limit grows by about `increase`
+    per round of requests. A rate limit (429), a timeout or a latency spike
+    multiplies the limit by `decrease`, at most once per round: responses to
+    requests sent before the last cut are not counted again.
+    """
+
+    def __init__(
+        self,
+        initial=2,
+        minimum=1,
+        maximum=32,
+        increase=1.0,
+        decrease=0.5,
+        spike_factor=3.0,
+        window=50,
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        # A latency above spike_factor times the recent median counts as a spike
+        self.spike_factor = spike_factor
+        self.latencies = deque(maxlen=window)
+
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+        self.started = time.monotonic()
+        self.peak_limit = self.limit
+        self.successes = 0
+        self.rate_limits = 0
+        self.timeouts = 0
+        self.spikes = 0
+        self.errors = 0
+        self.cancelled = 0
+
+    def acquire(self):
+        """Waits for a free slot and returns the time the request was sent."""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, sent_at, outcome="ok"):
+        """
+        Frees a slot and adjusts the limit.
+
+        Args:
+            sent_at (float): The value returned by acquire().
+            outcome (str): "ok", "rate_limit", "timeout", "error" or
+                "cancelled". Other errors and cancelled requests (e.g. the
+                losing copy of a hedged call) free the slot without changing
+                the limit.
+        """
+        latency = time.monotonic() - sent_at
+
+        with self.condition:
+            self.in_flight -= 1
+
+            if outcome == "ok":
+                self.successes += 1
+                spike = False
+                if len(self.latencies) >= 10:
+                    median = sorted(self.latencies)[len(self.latencies) // 2]
+                    spike = latency > self.spike_factor * median
+                self.latencies.append(latency)
+                if spike:
+                    self.spikes += 1
+                    self._decrease(sent_at)
+                else:
+                    self.limit = min(
+                        self.maximum, self.limit + self.increase / self.limit
+                    )
+                    self.peak_limit = max(self.peak_limit, self.limit)
+            elif outcome == "rate_limit":
+                self.rate_limits += 1
+                self._decrease(sent_at)
+            elif outcome == "timeout":
+                self.timeouts += 1
+                self._decrease(sent_at)
+            elif outcome == "cancelled":
+                self.cancelled += 1
+            else:
+                self.errors += 1
+
+            self.condition.notify_all()
+
+    def _decrease(self, sent_at):
+        if sent_at < self.last_decrease:
+            return
+        self.limit = max(self.minimum, self.limit * self.decrease)
+        self.last_decrease = time.monotonic()
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            "limit": self.limit,
+            "peak_limit": self.peak_limit,
+            "successes": self.successes,
+            "rate_limits": self.rate_limits,
+            "timeouts": self.timeouts,
+            "latency_spikes": self.spikes,
+            "errors": self.errors,
+            "cancelled": self.cancelled,
+            "throughput": self.successes / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+class LimiterSlot:
+    """
+    One slot of an AIMDLimiter, released at most once.
+
+    Lets another thread free the slot of a request that is still on the wire
+    (e.g. once the other copy of a hedged call has answered); the release the
+    request itself makes when its response finally arrives is then ignored.
+    """
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.sent_at = limiter.acquire()
+        self.released = False
+        self.lock = threading.Lock()
+
+    def release(self, outcome="ok"):
+        with self.lock:
+            if self.released:
+                return
+            self.released = True
+        self.limiter.release(self.sent_at, outcome)
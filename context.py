@@ -0,0 +1,114 @@
+import os
+import re
+from collections import Counter
+from dotenv import load_dotenv
+
+load_dotenv()  # Loads .env if present
+REFERENCE_TOKEN_BUDGET = int(os.getenv("REFERENCE_TOKEN_BUDGET", "1500"))
+PASSAGE_COLUMNS = [f"passage_{i}" for i in range(1, 11)]
+
+# Words and single punctuation marks; long words are charged roughly one
+# token per four characters, which slightly overestimates BPE tokenizers.
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+CITATION_PATTERN = re.compile(r"\[(\d+(?:\s*,\s*\d+)*)\]")
+
+
+def count_tokens(text):
+    """Estimates the number of tokens in a text without calling a tokenizer."""
+    return sum((len(piece) + 3) // 4 for piece in TOKEN_PATTERN.findall(text))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cuts a text after the last whole word that fits in max_tokens."""
+    used = 0
+    end = 0
+    for match in TOKEN_PATTERN.finditer(text):
+        used += (len(match.group()) + 3) // 4
+        if used > max_tokens:
+            break
+        end = match.end()
+    return text[:end]
+
+
+def rank_passages(item):
+    """
+    Orders the passage numbers of a row by how often the model answer cites them.
+
+    Cited passages come first, most cited first and ties broken by first
+    citation. Uncited passages follow in their original order.
+
+    Returns:
+        list: Passage numbers (1-based) of the non-empty passages.
+    """
+    available = [
+        number
+        for number, column in enumerate(PASSAGE_COLUMNS, start=1)
+        if item.get(column, "").strip()
+    ]
+
+    citations = []
+    for match in CITATION_PATTERN.finditer(item.get("model_answer", "")):
+        citations.extend(int(number) for number in match.group(1).split(","))
+
+    counts = Counter(citations)
+    first_seen = {}
+    for position, number in enumerate(citations):
+        first_seen.setdefault(number, position)
+
+    cited = sorted(
+        (number for number in available if number in counts),
+        key=lambda number: (-counts[number], first_seen[number]),
+    )
+    uncited = [number for number in available if number not in counts]
+    return cited + uncited
+
+
+def pack_passages(item, token_budget=REFERENCE_TOKEN_BUDGET):
+    """
+    Packs as many ranked passages of a row as fit into a token budget.
+
+    Each passage is labelled with its number so the judge can check citations
+    such as "[8]" against it. The first passage that does not fit is truncated
+    to the remaining budget and the rest are dropped.
+
+    Args:
+        item (dict): A CSV row with passage_1 through passage_10.
+        token_budget (int): The maximum number of tokens of the packed text.
+
+    Returns:
+        str: The packed passages.
+    """
+    blocks = []
+    remaining = token_budget
+
+    for number in rank_passages(item):
+        header = f"[{number}] "
+        text = item[f"passage_{number}"].strip()
+        cost = count_tokens(header) + count_tokens(text)
+
+        if cost <= remaining:
+            blocks.append(header + text)
+            remaining -= cost
+            continue
+
+        marker = " ..."
+        truncated = truncate_to_tokens(
+            text, remaining - count_tokens(header) - count_tokens(marker)
+        )
+        if truncated:
+            blocks.append(header + truncated + marker)
+        break
+
+    return "\n\n".join(blocks)
+
+
+def get_reference_answer(item, rubric, token_budget=REFERENCE_TOKEN_BUDGET):
+    """
+    Returns the reference section for a rubric.
+
+    Rubrics marked with "reference": "passages" get the packed passages, the
+    others keep passage_1 as the reference answer.
+    """
+    if rubric.get("reference") == "passages":
+        return pack_passages(item, token_budget)
+    return item.get("passage_1", "")
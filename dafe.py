@@ -1,72 +1,93 @@
 import json
 
 
-def main():
-    model_choices = [
-        ["gpt-3.5-turbo", "prometheus", "mistralai/mixtral-8x7b-instruct"],
-    ]
+def get_result_path(model_name):
+    return f"spanish_rosie_evals/{model_name.replace('/', '_')}_evaluation_results.json"
 
-    for models in model_choices:
-        judge_one = models[0]
-        judge_two = models[1]
-        arbitration = models[2]
 
-        judge_one_file = (
-            f"spanish_rosie_evals/{judge_one.replace('/', '_')}_evaluation_results.json"
-        )
-        judge_two_file = (
-            f"spanish_rosie_evals/{judge_two.replace('/', '_')}_evaluation_results.json"
-        )
-        arbitration_file = f"spanish_rosie_evals/{arbitration.replace('/', '_')}_evaluation_results.json"
+def get_dafe_path(judge_one, judge_two, arbitration):
+    return f"spanish_rosie_evals/dafe_{judge_one.replace('/', '_')}_{judge_two.replace('/', '_')}_{arbitration.replace('/', '_')}.json"
+
+
+def compute_dafe(judge_one_file, judge_two_file, arbitration_file):
+    """
+    Computes the DAFE judgment: the arbitration judge decides where the first two differ.
+
+    Args:
+        judge_one_file (str): Path to the first judge's result file (JSON).
+        judge_two_file (str): Path to the second judge's result file (JSON).
+        arbitration_file (str): Path to the arbitration judge's result file (JSON).
 
-        output_file = f"spanish_rosie_evals/dafe_{judge_one.replace('/', '_')}_{judge_two.replace('/', '_')}_{arbitration.replace('/', '_')}.json"
+    Returns:
+        dict: A dictionary containing the DAFE judgments.
+    """
+    with open(judge_one_file, "r", encoding="utf-8") as f:
+        data1 = json.load(f)
 
-        with open(judge_one_file, "r", encoding="utf-8") as f:
-            data1 = json.load(f)
+    with open(judge_two_file, "r", encoding="utf-8") as f:
+        data2 = json.load(f)
 
-        with open(judge_two_file, "r", encoding="utf-8") as f:
-            data2 = json.load(f)
+    with open(arbitration_file, "r", encoding="utf-8") as f:
+        data3 = json.load(f)
 
-        with open(arbitration_file, "r", encoding="utf-8") as f:
-            data3 = json.load(f)
+    output = {}
 
-        output = {}
+    for row_id in data1.keys():
+        if row_id not in data2 or row_id not in data3:
+            raise ValueError(f"Row {row_id} not found in all files.")
 
-        for question in data1.keys():
-            if question not in data2 or question not in data3:
-                raise ValueError(f"Question {question} not found in all files.")
+        data1_row = data1[row_id]
+        data2_row = data2[row_id]
+        data3_row = data3[row_id]
 
-            data1_question = data1[question]
-            data2_question = data2[question]
-            data3_question = data3[question]
+        current_item = {"question": data1_row.get("question", "")}
 
-            current_item = {}
+        for aspect in ["relevance", "attributes", "facts", "preference"]:
+            human_annotations = data1_row.get(aspect, {}).get(
+                "human_annotation", False
+            )
 
-            for aspect in ["relevance", "attributes", "facts", "preference"]:
-                human_annotations = data1_question.get(aspect, {}).get(
-                    "human_annotation", False
-                )
+            if data1_row.get(aspect, {}).get("acceptable") == data2_row.get(
+                aspect, {}
+            ).get("acceptable"):
+                current_item[aspect] = {
+                    "acceptable": data1_row.get(aspect, {}).get(
+                        "acceptable", False
+                    ),
+                    "human_annotation": human_annotations,
+                }
+            else:
+                current_item[aspect] = {
+                    "acceptable": data3_row.get(aspect, {}).get(
+                        "acceptable", False
+                    ),
+                    "human_annotation": human_annotations,
+                }
 
-                if data1_question.get(aspect, {}).get(
-                    "acceptable"
-                ) == data2_question.get(aspect, {}).get("acceptable"):
-                    current_item[aspect] = {
-                        "acceptable": data1_question.get(aspect, {}).get(
-                            "acceptable", False
-                        ),
-                        "human_annotation": human_annotations,
-                    }
-                else:
-                    current_item[aspect] = {
-                        "acceptable": data3_question.get(aspect, {}).get(
-                            "acceptable", False
-                        ),
-                        "human_annotation": human_annotations,
-                    }
+        output[row_id] = current_item
 
-            output[question] = current_item
+    return output
+
+
+def main():
+    model_choices = [
+        ["gpt-3.5-turbo", "prometheus", "mistralai/mixtral-8x7b-instruct"],
+    ]
+
+    for models in model_choices:
+        judge_one = models[0]
+        judge_two = models[1]
+        arbitration = models[2]
+
+        output = compute_dafe(
+            get_result_path(judge_one),
+            get_result_path(judge_two),
+            get_result_path(arbitration),
+        )
 
-        with open(output_file, "w", encoding="utf-8") as f:
+        with open(
+            get_dafe_path(judge_one, judge_two, arbitration), "w", encoding="utf-8"
+        ) as f:
             json.dump(output, f, ensure_ascii=False, indent=4)
 
 
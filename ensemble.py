@@ -1,82 +1,258 @@
 import json
+import sys
 import argparse
 
+ASPECTS = ["relevance", "attributes", "facts", "preference"]
+VOTING_METHODS = ["majority", "weighted", "threshold"]
 
-def compute_ensemble(file1, file2, file3):
+
+class ResultReader:
+    """
+    Reads the top-level entries of a result file one at a time.
+
+    Only the entry being decoded and one read chunk are held in memory, so
+    files of any size can be merged.
+    """
+
+    def __init__(self, path, chunk_size=1 << 16):
+        self.file = open(path, "r", encoding="utf-8")
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    def close(self):
+        self.file.close()
+
+    def _fill(self):
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.position :] + chunk
+        self.position = 0
+        return True
+
+    def _peek(self):
+        """Returns the next non-whitespace character without consuming it."""
+        while True:
+            while (
+                self.position < len(self.buffer)
+                and self.buffer[self.position].isspace()
+            ):
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._fill():
+                return ""
+
+    def _expect(self, chars):
+        char = self._peek()
+        if char not in chars:
+            raise ValueError(
+                f"Expected one of {chars!r} in {self.file.name}, got {char!r}"
+            )
+        self.position += 1
+        return char
+
+    def _decode(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                # A value that ends the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def __iter__(self):
+        self._expect("{")
+        if self._peek() == "}":
+            return
+
+        while True:
+            key = self._decode()
+            self._expect(":")
+            yield key, self._decode()
+            if self._expect(",}") == "}":
+                return
+
+
+def merge_results(files):
+    """
+    Walks several result files side by side, joined on the first file's row IDs.
+
+    Judge result files written from the same CSV share their key order, in
+    which case memory stays constant. Entries found out of order are held
+    until the first file reaches them.
+
+    Yields:
+        tuple: (row ID, list of entries with None where a file lacks the row)
+    """
+    readers = [ResultReader(path) for path in files]
+    iterators = [iter(reader) for reader in readers]
+    held = [{} for _ in files]
+
+    def find(index, row_id):
+        if row_id in held[index]:
+            return held[index].pop(row_id)
+        for key, entry in iterators[index]:
+            if key == row_id:
+                return entry
+            held[index][key] = entry
+        return None
+
+    try:
+        for row_id, entry in iterators[0]:
+            entries = [entry]
+            for index in range(1, len(files)):
+                entries.append(find(index, row_id))
+            yield row_id, entries
+    finally:
+        for reader in readers:
+            reader.close()
+
+
+def combine_aspect(entries, aspect, vote="majority", weights=None, threshold=3):
+    """
+    Combines the judgments of a panel on one aspect of one row.
+
+    Args:
+        entries (list): The row's entry from each result file, or None.
+        aspect (str): The aspect to combine.
+        vote (str): "majority" needs more than half of the panel to accept,
+            "weighted" needs more than half of the panel's total weight, and
+            "threshold" accepts when the average score is above threshold.
+        weights (list): One weight per result file, for weighted voting.
+        threshold (float): The average score to beat, for threshold voting.
+
+    Returns:
+        dict: The ensemble judgment for the aspect.
+    """
+    scores = []
+    acceptables = []
+    human_annotations = []
+    accepted_weight = 0.0
+
+    for index, entry in enumerate(entries):
+        if entry is None or aspect not in entry:
+            continue
+
+        score = entry[aspect].get("score")
+        if isinstance(score, (int, float)):
+            scores.append(score)
+
+        acceptable = entry[aspect].get("acceptable")
+        if isinstance(acceptable, bool):
+            acceptables.append(acceptable)
+            if acceptable and weights:
+                accepted_weight += weights[index]
+
+        human_annotation = entry[aspect].get("human_annotation")
+        if isinstance(human_annotation, bool):
+            human_annotations.append(human_annotation)
+
+    if scores:
+        avg_score = sum(scores) / len(scores)
+    else:
+        avg_score = None
+
+    if vote == "weighted":
+        ensemble_acceptable = accepted_weight > sum(weights) / 2
+    elif vote == "threshold":
+        ensemble_acceptable = avg_score is not None and avg_score > threshold
+    else:
+        # Majority of the whole panel, so a missing verdict counts against
+        ensemble_acceptable = acceptables.count(True) > len(entries) / 2
+
+    ensemble_human_annotation = any(human_annotations)
+
+    return {
+        "average_score": avg_score,
+        "acceptable": ensemble_acceptable,
+        "human_annotation": ensemble_human_annotation,
+        "individual_scores": scores,
+        "individual_acceptables": acceptables,
+        "individual_human_annotations": human_annotations,
+    }
+
+
+def iter_ensemble(files, vote="majority", weights=None, threshold=3):
+    """Yields (row ID, ensemble judgments) for every row of the first file."""
+    if vote not in VOTING_METHODS:
+        raise ValueError(f"Unknown voting method: {vote}")
+    if vote == "weighted" and (weights is None or len(weights) != len(files)):
+        raise ValueError("Weighted voting needs one weight per result file.")
+
+    for row_id, entries in merge_results(files):
+        judgments = {"question": entries[0].get("question", "")}
+        for aspect in ASPECTS:
+            judgments[aspect] = combine_aspect(
+                entries, aspect, vote, weights, threshold
+            )
+        yield row_id, judgments
+
+
+def compute_ensemble(*files, vote="majority", weights=None, threshold=3):
     """
-    Computes the ensemble judgment from three model result files.
+    Computes the ensemble judgment from any number of model result files.
 
     Args:
-        file1 (str): Path to the first model result file (JSON).
-        file2 (str): Path to the second model result file (JSON).
-        file3 (str): Path to the third model result file (JSON).
+        *files (str): Paths to the model result files (JSON).
+        vote (str): The voting method, one of VOTING_METHODS.
+        weights (list): One weight per result file, for weighted voting.
+        threshold (float): The average score to beat, for threshold voting.
 
     Returns:
         dict: A dictionary containing the ensemble judgments.
     """
-    with open(file1, "r") as f:
-        data1 = json.load(f)
-    with open(file2, "r") as f:
-        data2 = json.load(f)
-    with open(file3, "r") as f:
-        data3 = json.load(f)
-
-    ensemble_results = {}
-    all_questions = sorted(list(data1.keys()))
-
-    for question in all_questions:
-        ensemble_results[question] = {}
-        for aspect in ["relevance", "attributes", "facts", "preference"]:
-            scores = []
-            acceptables = []
-            human_annotations = []
-
-            for data in [data1, data2, data3]:
-                if question in data and aspect in data[question]:
-                    score = data[question][aspect].get("score")
-                    if isinstance(score, (int, float)):
-                        scores.append(score)
-
-                    acceptable = data[question][aspect].get("acceptable")
-                    if isinstance(acceptable, bool):
-                        acceptables.append(acceptable)
-
-                    human_annotation = data[question][aspect].get("human_annotation")
-                    if isinstance(human_annotation, bool):
-                        human_annotations.append(human_annotation)
-
-            if scores:
-                avg_score = sum(scores) / len(scores)
-            else:
-                avg_score = None
-
-            if acceptables:
-                # Majority vote for acceptable
-                ensemble_acceptable = acceptables.count(True) >= 2
-            else:
-                ensemble_acceptable = False
-
-            ensemble_human_annotation = any(human_annotations)
-
-            ensemble_results[question][aspect] = {
-                "average_score": avg_score,
-                "acceptable": ensemble_acceptable,
-                "human_annotation": ensemble_human_annotation,
-                "individual_scores": scores,
-                "individual_acceptables": acceptables,
-                "individual_human_annotations": human_annotations,
-            }
-
-    return ensemble_results
+    return dict(iter_ensemble(files, vote, weights, threshold))
+
+
+def write_ensemble(files, output, vote="majority", weights=None, threshold=3):
+    """Streams the ensemble judgments to an open text file as one JSON object."""
+    output.write("{")
+    for index, (row_id, judgments) in enumerate(
+        iter_ensemble(files, vote, weights, threshold)
+    ):
+        body = json.dumps(judgments, ensure_ascii=False, indent=4).replace(
+            "\n", "\n    "
+        )
+        separator = "," if index else ""
+        output.write(
+            f"{separator}\n    {json.dumps(row_id, ensure_ascii=False)}: {body}"
+        )
+    output.write("\n}\n")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
-        description="Compute ensemble judgments from three model result files."
+        description="Compute ensemble judgments from any number of model result files."
+    )
+    parser.add_argument("files", nargs="+", help="Paths to the model result files.")
+    parser.add_argument(
+        "--vote",
+        choices=VOTING_METHODS,
+        default="majority",
+        help="How the panel's verdicts are combined.",
+    )
+    parser.add_argument(
+        "--weights",
+        nargs="+",
+        type=float,
+        help="One weight per result file, for --vote weighted.",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=3,
+        help="Average score to beat, for --vote threshold.",
     )
-    parser.add_argument("file1", help="Path to the first model result file.")
-    parser.add_argument("file2", help="Path to the second model result file.")
-    parser.add_argument("file3", help="Path to the third model result file.")
     parser.add_argument(
         "-o",
         "--output",
@@ -85,11 +261,9 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    ensemble_data = compute_ensemble(args.file1, args.file2, args.file3)
-
     if args.output:
-        with open(args.output, "w") as f:
-            json.dump(ensemble_data, f, indent=4)
+        with open(args.output, "w", encoding="utf-8") as f:
+            write_ensemble(args.files, f, args.vote, args.weights, args.threshold)
         print(f"Ensemble results saved to {args.output}")
     else:
-        print(json.dumps(ensemble_data, indent=4))
+        write_ensemble(args.files, sys.stdout, args.vote, args.weights, args.threshold)
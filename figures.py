@@ -43,7 +43,7 @@ def calculate_metrics(file_path):
     for criterion in ["relevance", "attributes", "facts", "preference"]:
         predictions = []
         ground_truth = []
-        for question, aspects in data.items():
+        for row_id, aspects in data.items():
             if criterion in aspects:
                 values = aspects[criterion]
                 prediction = values.get("acceptable")
@@ -1,25 +1,236 @@
 import os
 import json
+import hashlib
 import logging
+import threading
 import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 import requests
 
+import llm_openai
+from concurrency import LimiterSlot
+
 load_dotenv()  # Loads .env if present
 JUDGE_ONE_MODEL = os.getenv("JUDGE_ONE_MODEL", "openai/gpt-4o-mini")
 JUDGE_TWO_MODEL = os.getenv("JUDGE_TWO_MODEL", "openai/gpt-4o-mini")
 ARBITRATION_MODEL = os.getenv("ARBITRATION_MODEL", "openai/gpt-4o-mini")
+# Responses are cached on disk only when this is set
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", "")
+SYSTEM_TEXT = "You are a helpful assistant acting as an impartial judge."
+
+# Opt-in request hedging: when a call is slower than HEDGE_PERCENTILE of the
+# model's recent calls, send a duplicate and keep the first valid answer.
+HEDGE_REQUESTS = os.getenv("HEDGE_REQUESTS", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+# At most this fraction of calls may send a duplicate
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.1"))
+# "same" duplicates through OpenRouter, "openai" sends openai/* models to the
+# OpenAI API directly (see llm_openai.py)
+HEDGE_ROUTE = os.getenv("HEDGE_ROUTE", "same")
+# Calls to observe per model before hedging starts
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
 
 logger = logging.getLogger(__name__)
 
 
+def get_cache_path(prompt_text, system_text, model_name, temperature):
+    """Returns the response cache file for a request, or None if caching is off."""
+    if not RESPONSE_CACHE_DIR:
+        return None
+
+    key = hashlib.sha256(
+        json.dumps(
+            [model_name, system_text, prompt_text, temperature], ensure_ascii=False
+        ).encode("utf-8")
+    ).hexdigest()
+    return os.path.join(RESPONSE_CACHE_DIR, f"{key}.json")
+
+
+class LatencyTracker:
+    """Keeps the latencies of the most recent successful calls of each model."""
+
+    def __init__(self, window=200):
+        self.window = window
+        self.latencies = {}
+        self.lock = threading.Lock()
+
+    def record(self, model_name, latency):
+        with self.lock:
+            self.latencies.setdefault(model_name, deque(maxlen=self.window)).append(
+                latency
+            )
+
+    def percentile(self, model_name, percentile):
+        """Returns the latency percentile of a model, or None with too few samples."""
+        with self.lock:
+            latencies = sorted(self.latencies.get(model_name, []))
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(percentile * len(latencies)))]
+
+
+class HedgeBudget:
+    """Caps duplicate requests at a fraction of all calls."""
+
+    def __init__(self, fraction):
+        self.fraction = fraction
+        self.calls = 0
+        self.hedges = 0
+        self.lock = threading.Lock()
+
+    def add_call(self):
+        with self.lock:
+            self.calls += 1
+
+    def try_spend(self):
+        with self.lock:
+            if self.hedges + 1 > self.fraction * self.calls:
+                return False
+            self.hedges += 1
+            return True
+
+
+latency_tracker = LatencyTracker()
+hedge_budget = HedgeBudget(HEDGE_BUDGET)
+
+
 def generate(
     prompt_text,
-    system_text="You are a helpful assistant acting as an impartial judge.",
+    system_text=SYSTEM_TEXT,
     model_name=JUDGE_ONE_MODEL,
     temperature=0.0,
     retries=10,  # Number of retries
+    limiter=None,  # concurrency.AIMDLimiter shared by the model's calls
 ):
+    cache_path = get_cache_path(prompt_text, system_text, model_name, temperature)
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return json.load(f)["response"]
+
+    if HEDGE_REQUESTS:
+        llm_response = hedged_completion(
+            prompt_text, system_text, model_name, temperature, retries, limiter
+        )
+    else:
+        llm_response = request_completion(
+            prompt_text, system_text, model_name, temperature, retries, None, limiter
+        )
+
+    if cache_path and llm_response:
+        os.makedirs(RESPONSE_CACHE_DIR, exist_ok=True)
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"model": model_name, "response": llm_response},
+                f,
+                ensure_ascii=False,
+            )
+    return llm_response
+
+
+def hedged_completion(
+    prompt_text, system_text, model_name, temperature, retries, limiter=None
+):
+    """
+    Sends a duplicate request when the first one is slower than usual.
+
+    The duplicate goes out once the call has taken longer than HEDGE_PERCENTILE
+    of the model's recent calls, if HEDGE_BUDGET allows it. The clock starts
+    when the first request gets its limiter slot, so time spent queueing for
+    the limiter does not count as slowness. The first non-empty answer wins;
+    the other request stops retrying and its answer is discarded (a request
+    already on the wire cannot be aborted, but its limiter slot is freed).
+    """
+    hedge_budget.add_call()
+    delay = latency_tracker.percentile(model_name, HEDGE_PERCENTILE)
+    cancelled = threading.Event()
+    sent = threading.Event()
+    slots = []
+    executor = ThreadPoolExecutor(max_workers=2)
+
+    try:
+        primary = executor.submit(
+            request_completion,
+            prompt_text,
+            system_text,
+            model_name,
+            temperature,
+            retries,
+            cancelled,
+            limiter,
+            slots,
+            sent,
+        )
+        if delay is None:
+            return primary.result()
+
+        while not sent.wait(0.1):
+            if primary.done():
+                return primary.result()
+
+        done, _ = wait([primary], timeout=delay)
+        if done or not hedge_budget.try_spend():
+            return primary.result()
+
+        if HEDGE_ROUTE == "openai" and model_name.startswith("openai/"):
+            logger.info(f"Hedging {model_name} call through the OpenAI API")
+            hedge = executor.submit(
+                llm_openai.generate,
+                prompt_text,
+                system_text,
+                model_name.split("/", 1)[1],
+                temperature,
+                1,
+            )
+        else:
+            logger.info(f"Hedging {model_name} call after {delay:.1f}s")
+            hedge = executor.submit(
+                request_completion,
+                prompt_text,
+                system_text,
+                model_name,
+                temperature,
+                1,
+                cancelled,
+                limiter,
+                slots,
+            )
+
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                llm_response = future.result()
+                if llm_response:
+                    return llm_response
+        return ""
+    finally:
+        cancelled.set()
+        # Free the slot of the request still on the wire
+        for slot in list(slots):
+            slot.release("cancelled")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def request_completion(
+    prompt_text,
+    system_text,
+    model_name,
+    temperature,
+    retries,
+    cancelled=None,
+    limiter=None,
+    slots=None,
+    sent=None,
+):
+    """
+    Calls the chat completions endpoint, retrying until answered or cancelled.
+
+    Each attempt holds a limiter slot, which is added to slots (if given) so
+    the caller can free it early; sent (if given) is set once the first
+    attempt is about to go out.
+    """
     api_key = os.getenv("OPENROUTER_API_KEY", "")
     base_url = os.getenv("BASE_URL", "https://openrouter.ai/api/v1")
 
@@ -62,7 +273,22 @@ def generate(
     }
 
     for attempt in range(1, retries + 1):
+        if cancelled is not None and cancelled.is_set():
+            return ""
+
+        slot = LimiterSlot(limiter) if limiter is not None else None
+        if slot is not None and slots is not None:
+            slots.append(slot)
+        if cancelled is not None and cancelled.is_set():
+            if slot is not None:
+                slot.release("cancelled")
+            return ""
+        if sent is not None:
+            sent.set()
+
+        outcome = "error"
         try:
+            start = time.monotonic()
             response = requests.post(
                 f"{base_url}/chat/completions",
                 headers=headers,
@@ -74,12 +300,21 @@ def generate(
             llm_response = response.json()["choices"][0]["message"]["content"]
             logger.debug(f"LLM raw response: {llm_response}")
             # print(llm_response)
+            latency_tracker.record(model_name, time.monotonic() - start)
+            outcome = "ok"
             return llm_response
 
         except requests.RequestException as e:
+            if isinstance(e, requests.Timeout):
+                outcome = "timeout"
+            elif e.response is not None and e.response.status_code == 429:
+                outcome = "rate_limit"
             logger.error(f"API request failed on attempt {attempt}: {e}")
         except (KeyError, json.JSONDecodeError) as e:
             logger.error(f"Failed to parse response on attempt {attempt}: {e}")
+        finally:
+            if slot is not None:
+                slot.release(outcome)
 
         if attempt < retries:
             time.sleep(3)  # wait 5 seconds before retrying
@@ -13,6 +13,25 @@ ARBITRATION_MODEL = os.getenv("ARBITRATION_MODEL", "gpt-3.5-turbo")
 logger = logging.getLogger(__name__)
 
 
+def get_client():
+    """
+    Creates an OpenAI client.
+
+    OPENAI_BASE_URL can point the client at a local stand-in server that
+    implements the chat completions, files and batches endpoints.
+    """
+    api_key = os.getenv("OPENAI_API_KEY", "")
+    base_url = os.getenv("OPENAI_BASE_URL") or None
+    return openai.OpenAI(api_key=api_key, base_url=base_url)
+
+
+def build_messages(prompt_text, system_text):
+    return [
+        {"role": "system", "content": system_text},
+        {"role": "user", "content": prompt_text},
+    ]
+
+
 def generate(
     prompt_text,
     system_text="You are a helpful assistant acting as an impartial judge.",
@@ -20,13 +39,9 @@ def generate(
     temperature=0.0,
     retries=10,  # Number of retries
 ):
-    api_key = os.getenv("OPENAI_API_KEY", "")
-    client = openai.OpenAI(api_key=api_key)
+    client = get_client()
 
-    messages = [
-        {"role": "system", "content": system_text},
-        {"role": "user", "content": prompt_text},
-    ]
+    messages = build_messages(prompt_text, system_text)
 
     for attempt in range(1, retries + 1):
         try:
@@ -48,3 +63,84 @@ def generate(
             time.sleep(3)  # wait 3 seconds before retrying
 
     return ""
+
+
+def build_batch_request(
+    custom_id,
+    prompt_text,
+    system_text="You are a helpful assistant acting as an impartial judge.",
+    model_name=JUDGE_ONE_MODEL,
+    temperature=0.0,
+):
+    """Builds one line of a Batch API input file, mirroring generate()."""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": model_name,
+            "messages": build_messages(prompt_text, system_text),
+            "temperature": temperature,
+            "max_tokens": 2048,
+        },
+    }
+
+
+def submit_batch(requests_path, metadata=None):
+    """
+    Uploads a JSONL file of batch requests and creates a batch for it.
+
+    Args:
+        requests_path (str): Path to a JSONL file built with build_batch_request().
+        metadata (dict): Optional metadata stored on the batch (e.g. the model name).
+
+    Returns:
+        Batch: The created batch object.
+    """
+    client = get_client()
+
+    with open(requests_path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+        metadata=metadata,
+    )
+    logger.info(f"Submitted batch {batch.id} from {requests_path}")
+    return batch
+
+
+def download_batch_results(batch):
+    """
+    Downloads the output of a finished batch.
+
+    Returns:
+        dict: The generated text keyed by custom_id. Requests that errored are
+        mapped to an empty string, the same fallback generate() uses.
+    """
+    client = get_client()
+    results = {}
+
+    for file_id in [batch.output_file_id, batch.error_file_id]:
+        if not file_id:
+            continue
+
+        content = client.files.content(file_id).text
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+
+            record = json.loads(line)
+            custom_id = record["custom_id"]
+            try:
+                body = record["response"]["body"]
+                results[custom_id] = body["choices"][0]["message"]["content"] or ""
+            except (KeyError, IndexError, TypeError):
+                logger.error(
+                    f"Batch request {custom_id} failed: {record.get('error')}"
+                )
+                results[custom_id] = ""
+
+    return results
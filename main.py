@@ -1,9 +1,54 @@
+import argparse
 import csv
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from llm import generate
+from concurrency import AIMDLimiter
+from context import count_tokens, get_reference_answer
+from plan import plan_sweep, print_plan
+from row_ids import ANNOTATION_COLUMNS, get_row_id, get_work_id
 import json
 from tqdm import tqdm
-from time import sleep
+
+EVALUATION_RUBRICS = [
+    {
+        "criteria": "Relevance: Is this answer topically relevant?",
+        "score1_description": "No",
+        "score2_description": "",
+        "score3_description": "",
+        "score4_description": "",
+        "score5_description": "Yes",
+    },
+    {
+        "criteria": "Attributes: All attributions correct?",
+        "score1_description": "No",
+        "score2_description": "",
+        "score3_description": "",
+        "score4_description": "",
+        "score5_description": "Yes",
+        "reference": "passages",
+    },
+    {
+        "criteria": "Facts: All facts in answer accounted for in passages?",
+        "score1_description": "No",
+        "score2_description": "",
+        "score3_description": "",
+        "score4_description": "",
+        "score5_description": "Yes",
+        "reference": "passages",
+    },
+    {
+        "criteria": "Preference: Do you prefer the reference or model_answer?",
+        "score1_description": "Prefer reference",
+        "score2_description": "",
+        "score3_description": "",
+        "score4_description": "",
+        "score5_description": "Prefer model_answer",
+    },
+]
+
+DATA_FILE = "spanish_reader_eval_v4_0_with_v2_0_karla_spanish_reader_eval_v4.csv"
 
 
 def create_absolute_grading_prompt(instruction, response, reference_answer, rubric):
@@ -32,6 +77,83 @@ Score 5: {rubric["score5_description"]}
     return prompt
 
 
+def create_packed_grading_prompt(items, rubric):
+    """
+    Formats one prompt that grades several responses on the same rubric.
+
+    Args:
+        items (list): (instruction, response, reference_answer) tuples.
+        rubric (dict): The evaluation criteria and score descriptions.
+
+    Returns:
+        str: A prompt asking for one "Item n: Feedback: ... [RESULT] n" line per item.
+    """
+    blocks = []
+    for number, (instruction, response, reference_answer) in enumerate(items, start=1):
+        blocks.append(f"""###Item {number}
+
+###The instruction to evaluate:
+{instruction}
+
+###Response to evaluate:
+{response}
+
+###Reference Answer:
+{reference_answer}""")
+    item_blocks = "\n\n".join(blocks)
+
+    prompt = f"""###Task Description:
+{len(items)} numbered items are given. Each item has an instruction (might include an Input inside it), a response to evaluate and a reference answer that gets a score of 5. A score rubric representing a evaluation criteria is given for all items.
+1. Grade every item on its own. For each item, write a one sentence feedback that assesses the quality of the response strictly based on the given score rubric, not evaluating in general.
+2. After writing a feedback, write a score that is an integer between 1 and 5. You should refer to the score rubric.
+3. The output format should be one line per item, in order, as follows: \"Item (item number): Feedback: (short feedback for criteria) [RESULT] (an integer number between 1 and 5)\"\nFor example, \"Item 1: Feedback: The answer is relevant to the question. [RESULT] 5\"
+4. Please do not generate any other opening, closing, and explanations.
+
+{item_blocks}
+
+###Score Rubrics:
+[{rubric["criteria"]}]
+Score 1: {rubric["score1_description"]}
+Score 5: {rubric["score5_description"]}
+
+###Feedback:"""
+    return prompt
+
+
+def parse_packed_judgments(generated_text, count):
+    """
+    Splits the output of a packed prompt into one judgment per item.
+
+    An item's text must hold exactly one "[RESULT] n", at its end; anything
+    else (e.g. two items on one line, or an item numbered twice) is treated as
+    missing so the item is asked again on its own rather than given another
+    item's verdict.
+
+    Returns:
+        list: The "Feedback: ... [RESULT] n" text of each item, or None where
+        the item's verdict is missing or ambiguous.
+    """
+    judgments = [None] * count
+    seen = set()
+    parts = re.split(r"(?im)^[\s*#]*item\s+(\d+)\s*[:.)]?\**", generated_text)
+
+    # parts alternates between text and item numbers: [preamble, n, text, n, text, ...]
+    for number, text in zip(parts[1::2], parts[2::2]):
+        index = int(number) - 1
+        if not 0 <= index < count:
+            continue
+        if index in seen:
+            judgments[index] = None
+            continue
+        seen.add(index)
+
+        text = text.strip()
+        if text.count("[RESULT]") == 1 and re.search(r"\[RESULT\]\s*\d+$", text):
+            judgments[index] = text
+
+    return judgments
+
+
 def load_data(file_path):
     """Loads data from a CSV file into a list of dictionaries."""
     data = []
@@ -42,134 +164,352 @@ def load_data(file_path):
     return data
 
 
-def main():
-    """Ï
-    Main function to run the VLLM inference with the Prometheus model.
-    """
-
-    model_names = ["openai/gpt-3.5-turbo"]
-
-    evaluation_rubrics = [
-        {
-            "criteria": "Relevance: Is this answer topically relevant?",
-            "score1_description": "No",
-            "score2_description": "",
-            "score3_description": "",
-            "score4_description": "",
-            "score5_description": "Yes",
-        },
-        {
-            "criteria": "Attributes: All attributions correct?",
-            "score1_description": "No",
-            "score2_description": "",
-            "score3_description": "",
-            "score4_description": "",
-            "score5_description": "Yes",
-        },
-        {
-            "criteria": "Facts: All facts in answer accounted for in passages?",
-            "score1_description": "No",
-            "score2_description": "",
-            "score3_description": "",
-            "score4_description": "",
-            "score5_description": "Yes",
-        },
-        {
-            "criteria": "Preference: Do you prefer the reference or model_answer?",
-            "score1_description": "Prefer reference",
-            "score2_description": "",
-            "score3_description": "",
-            "score4_description": "",
-            "score5_description": "Prefer model_answer",
-        },
-    ]
-
-    file_path = "spanish_reader_eval_v4_0_with_v2_0_karla_spanish_reader_eval_v4.csv"
-    evaluation_data = load_data(file_path)
-
-    # annotated data
-    has_all_columns = [
+def get_annotated_data(evaluation_data):
+    """Keeps only the rows that have all four human annotations."""
+    return [
         item
         for item in evaluation_data
-        if all(
-            item.get(col)
-            for col in [
-                "Do you prefer passage_1 or model_answer?",
-                "All facts in answer accounted for in passages?",
-                "All attributions correct?",
-                "Is this answer topically relevant?",
-            ]
-        )
+        if all(item.get(col) for col in ANNOTATION_COLUMNS)
     ]
 
-    for model_name in model_names:
-        score_mapping = {}
 
-        for item in tqdm(has_all_columns):
-            instruction = item.get("question", "")
-            response_to_evaluate = item.get("model_answer", "")
-            reference_answer = item.get("passage_1", "")
-            score_mapping[instruction] = {}
-            relevancy = (
-                "yes" in item.get("Is this answer topically relevant?", "").lower()
-            )
-            attribution = "yes" in item.get("All attributions correct?", "").lower()
-            facts = (
-                "yes"
-                in item.get(
-                    "All facts in answer accounted for in passages?", ""
-                ).lower()
+def get_human_annotation(item):
+    """Maps the human annotation columns of a row to one boolean per criterion."""
+    relevancy = "yes" in item.get("Is this answer topically relevant?", "").lower()
+    attribution = "yes" in item.get("All attributions correct?", "").lower()
+    facts = (
+        "yes"
+        in item.get("All facts in answer accounted for in passages?", "").lower()
+    )
+    prefer_model = (
+        "model" in item.get("Do you prefer passage_1 or model_answer?", "").lower()
+    )
+
+    return {
+        "relevance": relevancy,
+        "attributes": attribution,
+        "facts": facts,
+        "preference": prefer_model,
+    }
+
+
+def get_criteria_key(rubric):
+    return rubric["criteria"].split(":")[0].lower()
+
+
+def parse_judgment(generated_text, human_annotation):
+    """Parses a "Feedback: ... [RESULT] n" judgment into a score_mapping entry."""
+    try:
+        feedback, score = generated_text.rsplit("[RESULT]", 1)
+        score = int(score.strip())
+
+        return {
+            "feedback": feedback.strip(),
+            "score": score,
+            "acceptable": score > 3,
+            "human_annotation": human_annotation,
+        }
+    except ValueError:
+        return {
+            "feedback": generated_text.strip(),
+            "score": None,
+            "acceptable": False,
+        }
+
+
+def build_prompts(annotated_data, rubrics=EVALUATION_RUBRICS):
+    """Yields (item, rubric, prompt) for every row and rubric to grade."""
+    for item in annotated_data:
+        for rubric in rubrics:
+            absolute_prompt = create_absolute_grading_prompt(
+                item.get("question", ""),
+                item.get("model_answer", ""),
+                get_reference_answer(item, rubric),
+                rubric,
             )
-            prefer_model = (
-                "model"
-                in item.get("Do you prefer passage_1 or model_answer?", "").lower()
+            yield item, rubric, absolute_prompt
+
+
+def build_packed_prompts(annotated_data, pack_size, token_budget, include=None):
+    """
+    Groups rows into packed prompts of up to pack_size rows per rubric.
+
+    A pack is closed early when adding the next row would take the prompt
+    over token_budget; a row that does not fit on its own is sent alone.
+    A pack of one row uses the regular single-item prompt. If include is
+    given, only those build_prompts() indices are packed.
+
+    Yields:
+        tuple: (indices, prompt, packed) where indices point into
+            build_prompts() order and packed tells whether the prompt uses
+            the packed format.
+    """
+
+    def close(indices, items, rubric):
+        if len(items) == 1:
+            question, answer, reference = items[0]
+            prompt = create_absolute_grading_prompt(question, answer, reference, rubric)
+            return indices, prompt, False
+        return indices, create_packed_grading_prompt(items, rubric), True
+
+    for rubric_index, rubric in enumerate(EVALUATION_RUBRICS):
+        indices = []
+        items = []
+        for row_index, item in enumerate(annotated_data):
+            index = row_index * len(EVALUATION_RUBRICS) + rubric_index
+            if include is not None and index not in include:
+                continue
+
+            candidate = (
+                item.get("question", ""),
+                item.get("model_answer", ""),
+                get_reference_answer(item, rubric),
             )
+            prompt = create_packed_grading_prompt(items + [candidate], rubric)
+            if items and count_tokens(prompt) > token_budget:
+                yield close(indices, items, rubric)
+                indices, items = [], []
+
+            indices.append(index)
+            items.append(candidate)
+            if len(items) == pack_size:
+                yield close(indices, items, rubric)
+                indices, items = [], []
+
+        if items:
+            yield close(indices, items, rubric)
+
+
+def get_first_indices(prompts):
+    """Maps the work ID of every distinct prompt to its first index in prompts."""
+    first_index = {}
+    for index, (_, _, prompt) in enumerate(prompts):
+        first_index.setdefault(get_work_id(prompt), index)
+    return first_index
+
+
+def get_output_path(model_name):
+    return f"spanish_rosie_evals/{model_name.replace('/', '_')}_evaluation_results.json"
+
+
+def judge_model(
+    model_name,
+    annotated_data,
+    max_concurrency=16,
+    initial_concurrency=2,
+    pack_size=1,
+    pack_token_budget=6000,
+):
+    """
+    Grades every annotated row on every rubric with one judge model.
+
+    Requests are dispatched concurrently; an AIMD limiter finds how many the
+    model sustains in flight, between 1 and max_concurrency. With pack_size
+    above 1, up to pack_size rows share one request per rubric, and any row
+    whose verdict is missing from the packed answer is asked again on its own.
 
-            annotation = {
-                "relevance": relevancy,
-                "attributes": attribution,
-                "facts": facts,
-                "preference": prefer_model,
+    Identical prompts (same question, answer, reference and rubric) are sent
+    once and their judgment is copied to every row that needs it. Results are
+    keyed by row ID, with the question text kept as a field.
+    """
+    limiter = AIMDLimiter(initial=initial_concurrency, maximum=max_concurrency)
+    prompts = list(build_prompts(annotated_data))
+    responses = [None] * len(prompts)
+
+    # The first index of every distinct prompt does the work for the others
+    first_index = get_first_indices(prompts)
+    unique = sorted(first_index.values())
+    if len(unique) < len(prompts):
+        print(f"Skipping {len(prompts) - len(unique)} duplicate work item(s)")
+
+    def dispatch(jobs, desc):
+        """Sends (indices, prompt, packed) jobs; returns the indices left unjudged."""
+        missing = []
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = {
+                executor.submit(
+                    generate,
+                    model_name=model_name,
+                    prompt_text=prompt,
+                    limiter=limiter,
+                ): (indices, packed)
+                for indices, prompt, packed in jobs
             }
 
-            for rubric in evaluation_rubrics:
-                absolute_prompt = create_absolute_grading_prompt(
-                    instruction, response_to_evaluate, reference_answer, rubric
-                )
+            with tqdm(total=len(futures), desc=desc) as progress:
+                for future in as_completed(futures):
+                    indices, packed = futures[future]
+                    if not packed:
+                        responses[indices[0]] = future.result()
+                    else:
+                        judgments = parse_packed_judgments(
+                            future.result(), len(indices)
+                        )
+                        for index, judgment in zip(indices, judgments):
+                            if judgment is None:
+                                missing.append(index)
+                            else:
+                                responses[index] = judgment
+                    progress.set_postfix(
+                        limit=f"{limiter.limit:.1f}", in_flight=limiter.in_flight
+                    )
+                    progress.update()
+        return sorted(missing)
+
+    if pack_size > 1:
+        missing = dispatch(
+            build_packed_prompts(
+                annotated_data, pack_size, pack_token_budget, set(unique)
+            ),
+            f"{model_name} (packed)",
+        )
+        if missing:
+            print(f"Re-asking {len(missing)} item(s) missing from packed answers")
+            dispatch(
+                [([index], prompts[index][2], False) for index in missing], model_name
+            )
+    else:
+        dispatch([([index], prompts[index][2], False) for index in unique], model_name)
+
+    print_run_summary(model_name, limiter)
+
+    # Prompts are in row order, one per rubric
+    score_mapping = {}
+    for index, (item, rubric, prompt) in enumerate(prompts):
+        row_id = get_row_id(item)
+        if row_id not in score_mapping:
+            score_mapping[row_id] = {"question": item.get("question", "")}
+        annotation = get_human_annotation(item)
+
+        # parse score to int
+        criteria_key = get_criteria_key(rubric)
+        generated_text = responses[first_index[get_work_id(prompt)]]
+        score_mapping[row_id][criteria_key] = parse_judgment(
+            generated_text, annotation[criteria_key]
+        )
+
+    return score_mapping
 
-                generated_text = generate(
-                    model_name=model_name, prompt_text=absolute_prompt
+
+def print_run_summary(model_name, limiter):
+    summary = limiter.summary()
+    print(f"\nRun summary for {model_name}:")
+    print(
+        f"  - Concurrency limit: {summary['limit']:.1f} "
+        f"(peak {summary['peak_limit']:.1f})"
+    )
+    print(f"  - Throughput: {summary['throughput']:.2f} requests/s")
+    print(
+        f"  - Rate limits: {summary['rate_limits']}, timeouts: {summary['timeouts']}, "
+        f"latency spikes: {summary['latency_spikes']}, errors: {summary['errors']}"
+    )
+    print(f"  - Cancelled hedge losers: {summary['cancelled']}")
+
+
+def main():
+    """
+    Main function to grade the annotated data with the judge models.
+    """
+    parser = argparse.ArgumentParser(
+        description="Grade the annotated data with LLM judges."
+    )
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=["openai/gpt-3.5-turbo"],
+        help="Judge models to run.",
+    )
+    parser.add_argument(
+        "--pack-size",
+        type=int,
+        default=1,
+        help="Rows graded per request; above 1 packs rows into one prompt per rubric.",
+    )
+    parser.add_argument(
+        "--pack-token-budget",
+        type=int,
+        default=6000,
+        help="Upper bound on the tokens of a packed prompt.",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Estimate requests, tokens, cost and wall time without sending anything.",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=16,
+        help="Upper bound of requests in flight per model.",
+    )
+    parser.add_argument(
+        "--initial-concurrency",
+        type=int,
+        default=2,
+        help="Requests in flight per model before the limit adapts.",
+    )
+    parser.add_argument(
+        "--requests-per-minute",
+        type=float,
+        default=None,
+        help="Provider rate limit per model, used by --plan.",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=3.0,
+        help="Expected seconds per request, used by --plan.",
+    )
+    parser.add_argument(
+        "--output-tokens",
+        type=int,
+        default=60,
+        help="Expected completion tokens per graded item, used by --plan.",
+    )
+    args = parser.parse_args()
+
+    annotated_data = get_annotated_data(load_data(DATA_FILE))
+
+    if args.plan:
+        # Identical prompts are only sent once, as in judge_model()
+        prompts = list(build_prompts(annotated_data))
+        unique = sorted(get_first_indices(prompts).values())
+        if args.pack_size > 1:
+            packs = list(
+                build_packed_prompts(
+                    annotated_data, args.pack_size, args.pack_token_budget, set(unique)
                 )
+            )
+            prompts = [prompt for _, prompt, _ in packs]
+            # A packed answer holds one feedback line per item
+            item_counts = [len(indices) for indices, _, _ in packs]
+        else:
+            prompts = [prompts[index][2] for index in unique]
+            item_counts = None
+        plan = plan_sweep(
+            args.models,
+            prompts,
+            initial_concurrency=args.initial_concurrency,
+            max_concurrency=args.max_concurrency,
+            requests_per_minute=args.requests_per_minute,
+            latency=args.latency,
+            output_tokens=args.output_tokens,
+            item_counts=item_counts,
+        )
+        print_plan(plan)
+        return
+
+    for model_name in args.models:
+        score_mapping = judge_model(
+            model_name,
+            annotated_data,
+            max_concurrency=args.max_concurrency,
+            initial_concurrency=args.initial_concurrency,
+            pack_size=args.pack_size,
+            pack_token_budget=args.pack_token_budget,
+        )
 
-                sleep(0.3)
-
-                # parse score to int
-                try:
-                    feedback, score = generated_text.rsplit("[RESULT]", 1)
-                    score = int(score.strip())
-
-                    criteria_key = rubric["criteria"].split(":")[0].lower()
-
-                    score_mapping[instruction][criteria_key] = {
-                        "feedback": feedback.strip(),
-                        "score": score,
-                        "acceptable": score > 3,
-                        "human_annotation": annotation[criteria_key],
-                    }
-                except ValueError:
-                    score_mapping[instruction][
-                        rubric["criteria"].split(":")[0].lower()
-                    ] = {
-                        "feedback": generated_text.strip(),
-                        "score": None,
-                        "acceptable": False,
-                    }
-
-        with open(
-            f"spanish_rosie_evals/{model_name.replace('/', '_')}_evaluation_results.json",
-            "w",
-            encoding="utf-8",
-        ) as f:
+        with open(get_output_path(model_name), "w", encoding="utf-8") as f:
             json.dump(score_mapping, f, ensure_ascii=False, indent=4)
 
 
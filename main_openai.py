@@ -1,190 +1,200 @@
-import csv
-
-from llm_openai import generate
+import argparse
+import logging
+import os
+
+from llm_openai import (
+    build_batch_request,
+    download_batch_results,
+    generate,
+    get_client,
+    submit_batch,
+)
+from main import (
+    DATA_FILE,
+    build_prompts,
+    get_annotated_data,
+    get_criteria_key,
+    get_human_annotation,
+    get_output_path,
+    load_data,
+    parse_judgment,
+)
+from poll import poll_batch
+from row_ids import get_row_id, get_work_id
 import json
 from tqdm import tqdm
 from time import sleep
 
+BATCH_DIR = "batches"
+
+
+def save_results(model_name, score_mapping):
+    with open(get_output_path(model_name), "w", encoding="utf-8") as f:
+        json.dump(score_mapping, f, ensure_ascii=False, indent=4)
+
 
-def create_absolute_grading_prompt(instruction, response, reference_answer, rubric):
+def map_responses(annotated_data, responses):
     """
-    Formats the prompt for absolute grading according to the Prometheus model's requirements.
+    Builds a score_mapping from generated texts keyed by work ID.
 
-    Args:
-        instruction (str): The instruction given to the model that generated the response.
-        response (str): The response to be evaluated.
-        reference_answer (str): A ground-truth or ideal answer.
-        rubric (dict): A dictionary containing the evaluation criteria and score descriptions.
+    Results are keyed by row ID, with the question text kept as a field.
+    Raises a ValueError if a prompt has no response, which happens when the
+    prompts changed (e.g. a CSV edit or a new REFERENCE_TOKEN_BUDGET) since
+    the responses were requested.
+    """
+    prompts = list(build_prompts(annotated_data))
+    missing = {get_work_id(prompt) for _, _, prompt in prompts} - responses.keys()
+    if missing:
+        raise ValueError(
+            f"{len(missing)} of the rebuilt prompts have no response; the prompts "
+            "changed since they were submitted."
+        )
 
-    Returns:
-        str: A formatted prompt string.
+    score_mapping = {}
+
+    for item, rubric, absolute_prompt in prompts:
+        row_id = get_row_id(item)
+        if row_id not in score_mapping:
+            score_mapping[row_id] = {"question": item.get("question", "")}
+        annotation = get_human_annotation(item)
+
+        criteria_key = get_criteria_key(rubric)
+        generated_text = responses[get_work_id(absolute_prompt)]
+        score_mapping[row_id][criteria_key] = parse_judgment(
+            generated_text, annotation[criteria_key]
+        )
+
+    return score_mapping
+
+
+def run_sync(model_name, annotated_data):
+    """Grades every distinct (row, rubric) prompt with one chat completion call each."""
+    responses = {}
+
+    for _, _, absolute_prompt in tqdm(list(build_prompts(annotated_data))):
+        work_id = get_work_id(absolute_prompt)
+        if work_id in responses:
+            continue
+
+        responses[work_id] = generate(
+            model_name=model_name, prompt_text=absolute_prompt
+        )
+
+        sleep(0.3)
+
+    return map_responses(annotated_data, responses)
+
+
+def write_batch_requests(model_name, annotated_data, requests_path):
     """
-    # The prompt template is based on the official documentation for the Prometheus model.
-    # It provides a structured format for the model to understand the evaluation task.
-    prompt = f"""###Task Description:
-An instruction (might include an Input inside it), a response to evaluate, a reference answer that gets a score of 5, and a score rubric representing a evaluation criteria are given.
-1. Write a one sentence feedback that assesses the quality of the response strictly based on the given score rubric, not evaluating in general.
-2. After writing a feedback, write a score that is an integer between 1 and 5. You should refer to the score rubric.
-3. The output format should look as follows: \"Feedback: (short feedback for criteria) [RESULT] (an integer number between 1 and 5)\nFor example, \"Feedback: The answer is relevant to the question. [RESULT] 5\"
-4. Please do not generate any other opening, closing, and explanations.
+    Serializes every distinct (row, rubric) prompt into a Batch API input file.
 
-###The instruction to evaluate:
-{instruction}
+    The custom_id of each request is the work ID (prompt hash), so identical
+    prompts are submitted once and results can be mapped back after
+    reloading the CSV.
+    """
+    written = set()
+    with open(requests_path, "w", encoding="utf-8") as f:
+        for _, _, absolute_prompt in build_prompts(annotated_data):
+            work_id = get_work_id(absolute_prompt)
+            if work_id in written:
+                continue
+
+            written.add(work_id)
+            request = build_batch_request(
+                work_id, absolute_prompt, model_name=model_name
+            )
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
 
-###Response to evaluate:
-{response}
 
-###Reference Answer:
-{reference_answer}
+def run_batch(model_name, annotated_data, batch_id=None, poll_interval=30):
+    """
+    Grades every (row, rubric) pair through the Batch API.
 
-###Score Rubrics:
-[{rubric["criteria"]}]
-Score 1: {rubric["score1_description"]}
-Score 5: {rubric["score5_description"]}
+    Args:
+        model_name (str): The judge model.
+        annotated_data (list): The annotated rows to grade.
+        batch_id (str): Resume an already submitted batch instead of submitting a new one.
+        poll_interval (float): Seconds to wait between status checks.
 
-###Feedback:"""
-    return prompt
+    Returns:
+        dict: The score_mapping, or None if the batch did not complete.
+    """
+    if batch_id is None:
+        os.makedirs(BATCH_DIR, exist_ok=True)
+        requests_path = os.path.join(
+            BATCH_DIR, f"{model_name.replace('/', '_')}_requests.jsonl"
+        )
+        write_batch_requests(model_name, annotated_data, requests_path)
+        batch = submit_batch(requests_path, metadata={"model": model_name})
+        batch_id = batch.id
+        print(f"Submitted batch {batch_id} for {model_name}")
+        print(f"Resume with: python main_openai.py --resume {batch_id}")
 
+    batch = poll_batch(batch_id, poll_interval)
+    if batch.status != "completed":
+        print(f"Batch {batch_id} ended with status {batch.status}")
+        return None
 
-def load_data(file_path):
-    """Loads data from a CSV file into a list of dictionaries."""
-    data = []
-    with open(file_path, mode="r", newline="", encoding="utf-8") as csvfile:
-        csv_reader = csv.DictReader(csvfile)
-        for row in csv_reader:
-            data.append(dict(row))
-    return data
+    return map_responses(annotated_data, download_batch_results(batch))
 
 
 def main():
-    """Ï
-    Main function to run the VLLM inference with the Prometheus model.
     """
-
-    model_names = ["gpt-3.5-turbo"]
-
-    evaluation_rubrics = [
-        {
-            "criteria": "Relevance: Is this answer topically relevant?",
-            "score1_description": "No",
-            "score2_description": "",
-            "score3_description": "",
-            "score4_description": "",
-            "score5_description": "Yes",
-        },
-        {
-            "criteria": "Attributes: All attributions correct?",
-            "score1_description": "No",
-            "score2_description": "",
-            "score3_description": "",
-            "score4_description": "",
-            "score5_description": "Yes",
-        },
-        {
-            "criteria": "Facts: All facts in answer accounted for in passages?",
-            "score1_description": "No",
-            "score2_description": "",
-            "score3_description": "",
-            "score4_description": "",
-            "score5_description": "Yes",
-        },
-        {
-            "criteria": "Preference: Do you prefer the reference or model_answer?",
-            "score1_description": "Prefer reference",
-            "score2_description": "",
-            "score3_description": "",
-            "score4_description": "",
-            "score5_description": "Prefer model_answer",
-        },
-    ]
-
-    file_path = "spanish_reader_eval_v4_0_with_v2_0_karla_spanish_reader_eval_v4.csv"
-    evaluation_data = load_data(file_path)
-
-    # annotated data
-    has_all_columns = [
-        item
-        for item in evaluation_data
-        if all(
-            item.get(col)
-            for col in [
-                "Do you prefer passage_1 or model_answer?",
-                "All facts in answer accounted for in passages?",
-                "All attributions correct?",
-                "Is this answer topically relevant?",
-            ]
+    Main function to grade the annotated data with OpenAI judge models.
+    """
+    parser = argparse.ArgumentParser(
+        description="Grade the annotated data with OpenAI judge models."
+    )
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=["gpt-3.5-turbo"],
+        help="Judge models to run.",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Submit all prompts through the Batch API instead of one call each.",
+    )
+    parser.add_argument(
+        "--resume",
+        metavar="BATCH_ID",
+        help="Resume a previously submitted batch and write its results.",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=30,
+        help="Seconds to wait between batch status checks.",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    annotated_data = get_annotated_data(load_data(DATA_FILE))
+
+    if args.resume:
+        batch = get_client().batches.retrieve(args.resume)
+        model_name = (batch.metadata or {}).get("model", args.models[0])
+        score_mapping = run_batch(
+            model_name, annotated_data, args.resume, args.poll_interval
         )
-    ]
-
-    for model_name in model_names:
-        score_mapping = {}
-
-        for item in tqdm(has_all_columns):
-            instruction = item.get("question", "")
-            response_to_evaluate = item.get("model_answer", "")
-            reference_answer = item.get("passage_1", "")
-            score_mapping[instruction] = {}
-            relevancy = (
-                "yes" in item.get("Is this answer topically relevant?", "").lower()
-            )
-            attribution = "yes" in item.get("All attributions correct?", "").lower()
-            facts = (
-                "yes"
-                in item.get(
-                    "All facts in answer accounted for in passages?", ""
-                ).lower()
-            )
-            prefer_model = (
-                "model"
-                in item.get("Do you prefer passage_1 or model_answer?", "").lower()
+        if score_mapping is not None:
+            save_results(model_name, score_mapping)
+        return
+
+    for model_name in args.models:
+        if args.batch:
+            score_mapping = run_batch(
+                model_name, annotated_data, poll_interval=args.poll_interval
             )
+            if score_mapping is None:
+                continue
+        else:
+            score_mapping = run_sync(model_name, annotated_data)
 
-            annotation = {
-                "relevance": relevancy,
-                "attributes": attribution,
-                "facts": facts,
-                "preference": prefer_model,
-            }
-
-            for rubric in evaluation_rubrics:
-                absolute_prompt = create_absolute_grading_prompt(
-                    instruction, response_to_evaluate, reference_answer, rubric
-                )
-
-                generated_text = generate(
-                    model_name=model_name, prompt_text=absolute_prompt
-                )
-
-                sleep(0.3)
-
-                # parse score to int
-                try:
-                    feedback, score = generated_text.rsplit("[RESULT]", 1)
-                    score = int(score.strip())
-
-                    criteria_key = rubric["criteria"].split(":")[0].lower()
-
-                    score_mapping[instruction][criteria_key] = {
-                        "feedback": feedback.strip(),
-                        "score": score,
-                        "acceptable": score > 3,
-                        "human_annotation": annotation[criteria_key],
-                    }
-                except ValueError:
-                    score_mapping[instruction][
-                        rubric["criteria"].split(":")[0].lower()
-                    ] = {
-                        "feedback": generated_text.strip(),
-                        "score": None,
-                        "acceptable": False,
-                    }
-
-        with open(
-            f"spanish_rosie_evals/{model_name.replace('/', '_')}_evaluation_results.json",
-            "w",
-            encoding="utf-8",
-        ) as f:
-            json.dump(score_mapping, f, ensure_ascii=False, indent=4)
+        save_results(model_name, score_mapping)
 
 
 if __name__ == "__main__":
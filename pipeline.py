@@ -0,0 +1,409 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import dafe
+import ensemble
+import figures
+import main
+import main_openai
+from context import REFERENCE_TOKEN_BUDGET
+from row_ids import get_row_id
+
+MANIFEST_PATH = ".pipeline/manifest.json"
+
+# Judges graded through OpenRouter with main.py
+OPENROUTER_JUDGES = [
+    "anthropic/claude-3.5-sonnet",
+    "meta-llama/llama-3-70b-instruct",
+    "meta-llama/llama-3-8b-instruct",
+    "mistralai/mixtral-8x7b-instruct",
+    "openai/gpt-4",
+    "openai/gpt-4o-mini",
+]
+
+# Judges graded directly through the OpenAI API with main_openai.py
+OPENAI_JUDGES = ["gpt-3.5-turbo"]
+
+# Judges whose result files are produced outside this repo
+EXTERNAL_JUDGES = ["prometheus"]
+
+ENSEMBLES = {
+    "spanish_rosie_evals/ensemble_gpt-3.5-turbo_8x7b_prometheus.json": [
+        "gpt-3.5-turbo",
+        "mistralai/mixtral-8x7b-instruct",
+        "prometheus",
+    ],
+    "spanish_rosie_evals/ensemble_gpt3.5_gpt4_claude3.5.json": [
+        "gpt-3.5-turbo",
+        "openai/gpt-4",
+        "anthropic/claude-3.5-sonnet",
+    ],
+    "spanish_rosie_evals/ensemble_gpt4o-mini_gpt4_claude3.5.json": [
+        "openai/gpt-4o-mini",
+        "openai/gpt-4",
+        "anthropic/claude-3.5-sonnet",
+    ],
+    "spanish_rosie_evals/ensemble_llama8b_llama70b_8x7b.json": [
+        "meta-llama/llama-3-8b-instruct",
+        "meta-llama/llama-3-70b-instruct",
+        "mistralai/mixtral-8x7b-instruct",
+    ],
+    "spanish_rosie_evals/ensemble_prometheus_gpt3.5_llama8b.json": [
+        "prometheus",
+        "gpt-3.5-turbo",
+        "meta-llama/llama-3-8b-instruct",
+    ],
+}
+
+# (judge one, judge two, arbitration)
+DAFE_PANELS = [
+    ["gpt-3.5-turbo", "anthropic/claude-3.5-sonnet", "openai/gpt-4"],
+    ["gpt-3.5-turbo", "prometheus", "meta-llama/llama-3-8b-instruct"],
+    ["gpt-3.5-turbo", "prometheus", "mistralai/mixtral-8x7b-instruct"],
+    [
+        "meta-llama/llama-3-8b-instruct",
+        "meta-llama/llama-3-70b-instruct",
+        "mistralai/mixtral-8x7b-instruct",
+    ],
+    ["openai/gpt-4o-mini", "anthropic/claude-3.5-sonnet", "openai/gpt-4"],
+]
+
+FIGURES = ["figures/f1_score_faceted.png", "figures/precision_recall_faceted.png"]
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+
+
+def get_annotated_row_ids():
+    annotated_data = main.get_annotated_data(main.load_data(main.DATA_FILE))
+    return sorted({get_row_id(item) for item in annotated_data})
+
+
+def build_judge(model_name, judge, full):
+    """
+    Judges the annotated rows that are missing from a model's result file.
+
+    Entries of rows still in the dataset are kept, entries of rows that are
+    gone are dropped, and only new or changed rows (which get a new row ID)
+    are sent to the judge. With full set, every row is judged again.
+
+    Args:
+        model_name (str): The judge model.
+        judge (callable): main.judge_model or main_openai.run_sync.
+        full (bool): Ignore the existing result file.
+    """
+    annotated_data = main.get_annotated_data(main.load_data(main.DATA_FILE))
+    output_path = main.get_output_path(model_name)
+
+    existing = {}
+    if not full and os.path.exists(output_path):
+        with open(output_path, "r", encoding="utf-8") as f:
+            existing = json.load(f)
+
+    rows = [item for item in annotated_data if get_row_id(item) not in existing]
+    print(f"Judging {len(rows)} of {len(annotated_data)} rows with {model_name}")
+    judged = judge(model_name, rows) if rows else {}
+
+    score_mapping = {}
+    for item in annotated_data:
+        row_id = get_row_id(item)
+        score_mapping[row_id] = (
+            existing[row_id] if row_id in existing else judged[row_id]
+        )
+    write_json(output_path, score_mapping)
+
+
+def build_ensemble(output_path, model_names):
+    files = [dafe.get_result_path(model_name) for model_name in model_names]
+    with open(output_path, "w", encoding="utf-8") as f:
+        ensemble.write_ensemble(files, f)
+
+
+def build_dafe(judge_one, judge_two, arbitration):
+    output = dafe.compute_dafe(
+        dafe.get_result_path(judge_one),
+        dafe.get_result_path(judge_two),
+        dafe.get_result_path(arbitration),
+    )
+    write_json(dafe.get_dafe_path(judge_one, judge_two, arbitration), output)
+
+
+def get_nodes():
+    """
+    Describes every artifact of the pipeline as a node.
+
+    Each node lists its output files, the files it reads and the parameters
+    that change its output. A node is rebuilt when its outputs are missing or
+    when the hash of its inputs and parameters differs from the last build.
+
+    Judge nodes depend on the row IDs of the annotated rows rather than on the
+    whole CSV, and are built incrementally: only new or changed rows are
+    judged, unless their parameters changed.
+    """
+    rubric_params = {
+        "rubrics": main.EVALUATION_RUBRICS,
+        "reference_token_budget": REFERENCE_TOKEN_BUDGET,
+    }
+    nodes = []
+
+    row_ids = get_annotated_row_ids()
+    judges = [
+        (model_name, "main", main.judge_model) for model_name in OPENROUTER_JUDGES
+    ] + [
+        (model_name, "main_openai", main_openai.run_sync)
+        for model_name in OPENAI_JUDGES
+    ]
+
+    for model_name, runner, judge in judges:
+        nodes.append(
+            {
+                "name": f"judge:{model_name}",
+                "outputs": [main.get_output_path(model_name)],
+                "inputs": [],
+                "rows": row_ids,
+                "params": {"model": model_name, "runner": runner, **rubric_params},
+                "incremental": True,
+                "build": lambda full, model_name=model_name, judge=judge: (
+                    build_judge(model_name, judge, full)
+                ),
+            }
+        )
+
+    for output_path, model_names in ENSEMBLES.items():
+        nodes.append(
+            {
+                "name": f"ensemble:{os.path.basename(output_path)}",
+                "outputs": [output_path],
+                "inputs": [dafe.get_result_path(m) for m in model_names],
+                "params": {"models": model_names},
+                "build": lambda output_path=output_path, model_names=model_names: (
+                    build_ensemble(output_path, model_names)
+                ),
+            }
+        )
+
+    for panel in DAFE_PANELS:
+        output_path = dafe.get_dafe_path(*panel)
+        nodes.append(
+            {
+                "name": f"dafe:{os.path.basename(output_path)}",
+                "outputs": [output_path],
+                "inputs": [dafe.get_result_path(m) for m in panel],
+                "params": {"models": panel},
+                "build": lambda panel=panel: build_dafe(*panel),
+            }
+        )
+
+    # The charts read every result file, including ones not built here
+    result_files = {output for node in nodes for output in node["outputs"]}
+    result_files.update(
+        dafe.get_result_path(model_name) for model_name in EXTERNAL_JUDGES
+    )
+    result_files.update(glob.glob("spanish_rosie_evals/*.json"))
+    nodes.append(
+        {
+            "name": "figures",
+            "outputs": FIGURES,
+            "inputs": sorted(result_files),
+            "params": {},
+            "build": figures.main,
+        }
+    )
+
+    return nodes
+
+
+def hash_json(data):
+    return hashlib.sha256(
+        json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
+def get_signature(node):
+    """Hashes a node's parameters together with the current content of its inputs."""
+    return hash_json(
+        {
+            "params": node["params"],
+            "inputs": {path: hash_file(path) for path in node["inputs"]},
+            "rows": node.get("rows", []),
+        }
+    )
+
+
+def outputs_complete(node):
+    """
+    Checks that a node's outputs exist and, for incremental nodes, that they
+    hold an entry for every current row ID.
+    """
+    if not all(os.path.exists(path) for path in node["outputs"]):
+        return False
+    if not node.get("incremental"):
+        return True
+
+    for path in node["outputs"]:
+        with open(path, "r", encoding="utf-8") as f:
+            row_ids = json.load(f).keys()
+        if not set(node["rows"]) <= row_ids:
+            return False
+    return True
+
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest):
+    os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+    with open(MANIFEST_PATH, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+
+
+def run_pipeline(nodes, jobs=4, dry_run=False, force=()):
+    """
+    Rebuilds the stale nodes of the pipeline, running independent nodes in parallel.
+
+    Outputs that exist but have no manifest entry (e.g. the result files
+    committed to the repo, on a fresh clone) are recorded as up to date rather
+    than rebuilt, so judges are never re-run just because the manifest is new.
+    Judge outputs that lack any current row ID are always stale; rebuilding
+    them only judges the missing rows.
+
+    Args:
+        nodes (list): The nodes from get_nodes().
+        jobs (int): Maximum number of nodes built at the same time.
+        dry_run (bool): Only report which nodes would be rebuilt.
+        force (iterable): Names of nodes to rebuild from scratch even if they
+            are up to date.
+
+    Returns:
+        list: The names of the nodes that were (or would be) rebuilt.
+    """
+    manifest = load_manifest()
+    producers = {output: node["name"] for node in nodes for output in node["outputs"]}
+    dependencies = {
+        node["name"]: {producers[path] for path in node["inputs"] if path in producers}
+        - {node["name"]}
+        for node in nodes
+    }
+
+    pending = {node["name"]: node for node in nodes}
+    finished = set()
+    rebuilt = []
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            ready = [name for name in pending if dependencies[name] <= finished]
+            if not ready and not running:
+                raise ValueError(f"Dependency cycle between {sorted(pending)}")
+
+            for name in ready:
+                node = pending.pop(name)
+                # An output missing rows (e.g. after a CSV edit) is never adopted
+                outputs_exist = outputs_complete(node)
+
+                if dry_run and dependencies[name] & set(rebuilt):
+                    # Upstream outputs would change, so their hashes are unknown yet
+                    rebuilt.append(name)
+                    finished.add(name)
+                    continue
+
+                signature = get_signature(node)
+                params = hash_json(node["params"])
+                if outputs_exist and name not in manifest:
+                    manifest[name] = {"signature": signature, "params": params}
+
+                recorded = manifest.get(name, {})
+                stale = (
+                    not outputs_exist
+                    or recorded.get("signature") != signature
+                    or name in force
+                )
+                if not stale:
+                    finished.add(name)
+                    continue
+
+                rebuilt.append(name)
+                if dry_run:
+                    finished.add(name)
+                    continue
+
+                print(f"Building {name}...")
+                if node.get("incremental"):
+                    # Changed parameters invalidate every row, not just new ones;
+                    # an unrecorded output is assumed to match the current ones
+                    full = name in force or recorded.get("params", params) != params
+                    future = executor.submit(node["build"], full)
+                else:
+                    future = executor.submit(node["build"])
+                running[future] = (name, {"signature": signature, "params": params})
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, entry = running.pop(future)
+                future.result()
+                manifest[name] = entry
+                save_manifest(manifest)
+                finished.add(name)
+
+    if not dry_run:
+        save_manifest(manifest)
+
+    return rebuilt
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rebuild stale judge results, ensembles, DAFE results and figures."
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=4, help="Nodes to build in parallel."
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only list the nodes that would be rebuilt.",
+    )
+    parser.add_argument(
+        "--force",
+        nargs="+",
+        default=[],
+        metavar="NODE",
+        help="Rebuild these nodes (e.g. judge:openai/gpt-4) even if up to date.",
+    )
+
+    args = parser.parse_args()
+
+    rebuilt = run_pipeline(
+        get_nodes(),
+        jobs=args.jobs,
+        dry_run=args.dry_run,
+        force=set(args.force),
+    )
+
+    if args.dry_run:
+        print("Stale nodes:")
+        for name in rebuilt:
+            print(f"  - {name}")
+    else:
+        print(f"Rebuilt {len(rebuilt)} node(s).")
@@ -0,0 +1,147 @@
+import os
+
+from context import count_tokens
+from llm import SYSTEM_TEXT, get_cache_path
+
+# Approximate OpenRouter prices in USD per million (input, output) tokens
+MODEL_PRICES = {
+    "openai/gpt-3.5-turbo": (0.5, 1.5),
+    "openai/gpt-4": (30.0, 60.0),
+    "openai/gpt-4o-mini": (0.15, 0.6),
+    "anthropic/claude-3.5-sonnet": (3.0, 15.0),
+    "meta-llama/llama-3-8b-instruct": (0.03, 0.06),
+    "meta-llama/llama-3-70b-instruct": (0.3, 0.4),
+    "mistralai/mixtral-8x7b-instruct": (0.54, 0.54),
+}
+
+# Chat formatting overhead per message (role markers and separators)
+TOKENS_PER_MESSAGE = 4
+
+
+def estimate_wall_time(
+    requests, initial_concurrency, max_concurrency, latency, requests_per_minute
+):
+    """
+    Estimates the seconds a model needs for its requests under the AIMD limiter.
+
+    Each round of `latency` seconds sends as many requests as the current
+    limit allows (or the rate limit, if lower), after which the limit grows
+    by one, as it does when no request is throttled. This is a best case.
+    """
+    elapsed = 0.0
+    remaining = requests
+    limit = initial_concurrency
+    while remaining > 0:
+        sent = min(remaining, limit)
+        round_time = latency
+        if requests_per_minute:
+            round_time = max(round_time, sent / (requests_per_minute / 60))
+        elapsed += round_time
+        remaining -= sent
+        limit = min(max_concurrency, limit + 1)
+    return elapsed
+
+
+def plan_sweep(
+    model_names,
+    prompts,
+    initial_concurrency=2,
+    max_concurrency=16,
+    requests_per_minute=None,
+    latency=3.0,
+    output_tokens=60,
+    temperature=0.0,
+    item_counts=None,
+):
+    """
+    Estimates the cost of grading prompts with each model without sending anything.
+
+    Prompts already in the local response cache are counted as cache hits and
+    excluded from the request, token, cost and time estimates.
+
+    Args:
+        model_names (list): The judge models of the sweep.
+        prompts (list): The prompts every model will grade.
+        initial_concurrency (int): Requests in flight per model at the start.
+        max_concurrency (int): Upper bound of requests in flight per model.
+        requests_per_minute (float): Provider rate limit per model, if any.
+        latency (float): Expected seconds per request.
+        output_tokens (int): Expected completion tokens per verdict.
+        temperature (float): The sampling temperature, part of the cache key.
+        item_counts (list): The number of items graded by each prompt, for
+            packed prompts that answer with one verdict per item. Defaults
+            to one per prompt.
+
+    Returns:
+        dict: The estimate for each model.
+    """
+    system_tokens = count_tokens(SYSTEM_TEXT) + 2 * TOKENS_PER_MESSAGE
+    prompt_tokens = [count_tokens(prompt) + system_tokens for prompt in prompts]
+    if item_counts is None:
+        item_counts = [1] * len(prompts)
+
+    plan = {}
+    for model_name in model_names:
+        requests = 0
+        cache_hits = 0
+        input_tokens = 0
+        total_output_tokens = 0
+
+        for prompt, tokens, items in zip(prompts, prompt_tokens, item_counts):
+            cache_path = get_cache_path(prompt, SYSTEM_TEXT, model_name, temperature)
+            if cache_path and os.path.exists(cache_path):
+                cache_hits += 1
+                continue
+
+            requests += 1
+            input_tokens += tokens
+            total_output_tokens += items * output_tokens
+
+        if model_name in MODEL_PRICES:
+            input_price, output_price = MODEL_PRICES[model_name]
+            cost = (
+                input_tokens * input_price + total_output_tokens * output_price
+            ) / 1e6
+        else:
+            cost = None
+
+        plan[model_name] = {
+            "requests": requests,
+            "cache_hits": cache_hits,
+            "input_tokens": input_tokens,
+            "output_tokens": total_output_tokens,
+            "cost": cost,
+            "wall_time": estimate_wall_time(
+                requests,
+                initial_concurrency,
+                max_concurrency,
+                latency,
+                requests_per_minute,
+            ),
+        }
+
+    return plan
+
+
+def print_plan(plan):
+    print("Sweep plan:")
+    for model_name, estimate in plan.items():
+        cost = estimate["cost"]
+        hours = estimate["wall_time"] / 3600
+
+        print(f"\nModel: {model_name}")
+        print(
+            f"  - Requests: {estimate['requests']} ({estimate['cache_hits']} cached)"
+        )
+        print(f"  - Input tokens: {estimate['input_tokens']}")
+        print(f"  - Output tokens: {estimate['output_tokens']}")
+        print(f"  - Cost: {'unknown' if cost is None else f'${cost:.2f}'}")
+        print(f"  - Wall time: {hours:.2f}h")
+
+    known_costs = [e["cost"] for e in plan.values() if e["cost"] is not None]
+    print(f"\nTotal requests: {sum(e['requests'] for e in plan.values())}")
+    print(f"Total cost (priced models): ${sum(known_costs):.2f}")
+    print(
+        f"Wall time if models run one after another: "
+        f"{sum(e['wall_time'] for e in plan.values()) / 3600:.2f}h"
+    )
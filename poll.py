@@ -0,0 +1,70 @@
+import argparse
+import logging
+import time
+
+from llm_openai import get_client
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def poll_batch(batch_id, poll_interval=30):
+    """
+    Polls a batch until it reaches a terminal status.
+
+    Args:
+        batch_id (str): The ID of the batch to poll.
+        poll_interval (float): Seconds to wait between status checks.
+
+    Returns:
+        Batch: The batch object in its terminal state.
+    """
+    client = get_client()
+
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        if counts is not None:
+            logger.info(
+                f"Batch {batch_id}: {batch.status} "
+                f"({counts.completed}/{counts.total} completed, {counts.failed} failed)"
+            )
+        else:
+            logger.info(f"Batch {batch_id}: {batch.status}")
+
+        if batch.status in TERMINAL_STATUSES:
+            return batch
+
+        time.sleep(poll_interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the status of a batch.")
+    parser.add_argument("batch_id", help="The ID of the batch to check.")
+    parser.add_argument(
+        "--wait",
+        action="store_true",
+        help="Keep polling until the batch reaches a terminal status.",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=30,
+        help="Seconds to wait between status checks when --wait is given.",
+    )
+
+    args = parser.parse_args()
+
+    if args.wait:
+        logging.basicConfig(level=logging.INFO)
+        batch = poll_batch(args.batch_id, args.poll_interval)
+    else:
+        batch = get_client().batches.retrieve(args.batch_id)
+
+    print(f"{batch.id}: {batch.status}")
+    if batch.request_counts is not None:
+        print(
+            f"  - {batch.request_counts.completed}/{batch.request_counts.total} completed, "
+            f"{batch.request_counts.failed} failed"
+        )
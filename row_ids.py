@@ -0,0 +1,95 @@
+import argparse
+import hashlib
+import json
+
+from context import PASSAGE_COLUMNS
+
+# The columns a judge sees; identical judge work is deduplicated by get_work_id
+ROW_COLUMNS = ["question", "model_answer"] + PASSAGE_COLUMNS
+ANNOTATION_COLUMNS = [
+    "Do you prefer passage_1 or model_answer?",
+    "All facts in answer accounted for in passages?",
+    "All attributions correct?",
+    "Is this answer topically relevant?",
+]
+
+
+def get_row_id(item):
+    """
+    Returns a stable content hash of a CSV row, used as its key in result files.
+
+    The human annotations are part of the hash, so rows that only differ in
+    their labels keep separate entries.
+    """
+    content = json.dumps(
+        [item.get(col, "") for col in ROW_COLUMNS + ANNOTATION_COLUMNS],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:12]
+
+
+def get_work_id(prompt_text):
+    """Returns a hash of a prompt, shared by every (row, rubric) pair that builds it."""
+    return hashlib.sha256(prompt_text.encode("utf-8")).hexdigest()[:16]
+
+
+def migrate_result_file(file_path, annotated_data):
+    """
+    Re-keys a result file to the current row IDs.
+
+    Handles files keyed by question text and files keyed by an older row ID
+    scheme, using the "question" field where present. Rows that shared a
+    question overwrote each other in the question-keyed format, so a question
+    that now maps to several different rows cannot be migrated.
+
+    Returns:
+        bool: False if the file already uses the current row IDs.
+    """
+    with open(file_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    row_ids = {}
+    for item in annotated_data:
+        row_ids.setdefault(item.get("question", ""), set()).add(get_row_id(item))
+    current_ids = set().union(*row_ids.values())
+
+    if all(key in current_ids and "question" in entry for key, entry in data.items()):
+        return False
+
+    migrated = {}
+    for key, entry in data.items():
+        question = entry.get("question", key)
+        if question not in row_ids:
+            raise ValueError(f"Question {question} not found in the dataset.")
+        if len(row_ids[question]) > 1:
+            raise ValueError(
+                f"Question {question} matches {len(row_ids[question])} different "
+                f"rows; {file_path} has a single entry for it."
+            )
+        (row_id,) = row_ids[question]
+        migrated[row_id] = {"question": question}
+        migrated[row_id].update(
+            (field, value) for field, value in entry.items() if field != "question"
+        )
+
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump(migrated, f, ensure_ascii=False, indent=4)
+    return True
+
+
+if __name__ == "__main__":
+    from main import DATA_FILE, get_annotated_data, load_data
+
+    parser = argparse.ArgumentParser(
+        description="Re-key result files to the current row IDs."
+    )
+    parser.add_argument("files", nargs="+", help="Result files to migrate in place.")
+
+    args = parser.parse_args()
+
+    annotated_data = get_annotated_data(load_data(DATA_FILE))
+    for file_path in args.files:
+        if migrate_result_file(file_path, annotated_data):
+            print(f"Migrated {file_path}")
+        else:
+            print(f"Skipped {file_path} (already keyed by current row IDs)")
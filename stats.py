@@ -7,8 +7,10 @@ def analyze_results(file_path):
 
     criteria = {}
 
-    for question, results in data.items():
+    for row_id, results in data.items():
         for criterion, values in results.items():
+            if criterion == "question":
+                continue
             if criterion not in criteria:
                 criteria[criterion] = {
                     "total": 0,